@@ -0,0 +1,191 @@
+"""Local stand-in for the Barry JSON-RPC endpoint.
+
+Serves the OpenApiController methods the integration uses from the
+synthetic hourly profiles in fixtures/barry.json, for any requested
+range, with injectable latency, server errors and batch rejection.
+Calls matching the request of an exchange in fixtures/responses, e.g.
+the 25 hour day DST ends on, are answered with its response instead.
+Every HTTP request and JSON-RPC call is counted.
+
+Run it standalone to point a client at it by hand:
+
+    python bench/fake_barry.py --port 8080 --latency 0.05
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import random
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "barry.json")
+RESPONSES = os.path.join(os.path.dirname(FIXTURES), "responses")
+METHOD_PREFIX = "co.getbarry.api.v1.OpenApiController."
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def _parse(stamp):
+    return datetime.strptime(stamp, TIME_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def _load_responses(directory):
+    """Results of the exchanges in a directory by method and params."""
+    responses = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name), encoding="utf-8") as exchange:
+            exchange = json.load(exchange)
+        request = exchange["request"]
+        responses[(request["method"], json.dumps(request["params"]))] = \
+            exchange["response"]
+    return responses
+
+
+def _hours(start, end):
+    hour = _parse(start)
+    end = _parse(end)
+    while hour < end:
+        yield hour
+        hour += timedelta(hours=1)
+
+
+class FakeBarryServer:
+    """aiohttp server answering like jsonrpc.barry.energy."""
+
+    def __init__(self, fixtures=FIXTURES, latency=0.0, error_rate=0.0,
+                 reject_batches=False, published_until=None, responses=RESPONSES):
+        with open(fixtures, encoding="utf-8") as fixture:
+            self.fixtures = json.load(fixture)
+        self.responses = _load_responses(responses) if responses else {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.reject_batches = reject_batches
+        # Hours from this time on are answered with an empty result
+        self.published_until = published_until
+        self.requests = 0
+        self.calls = 0
+        self.url = None
+        self._runner = None
+
+    def reset_counters(self):
+        self.requests = 0
+        self.calls = 0
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_post("/json-rpc", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+        self.url = f"http://{host}:{port}/json-rpc"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return web.Response(status=503, text="Service Unavailable")
+
+        body = await request.json()
+        if isinstance(body, list):
+            if self.reject_batches:
+                return web.json_response({
+                    "jsonrpc": "2.0", "id": None,
+                    "error": {"code": -32600, "message": "Invalid Request"},
+                })
+            return web.json_response([self._answer(call) for call in body])
+        return web.json_response(self._answer(body))
+
+    def _answer(self, call):
+        self.calls += 1
+        response = self.responses.get((call["method"], json.dumps(call["params"])))
+        if response is not None:
+            return dict(response, id=call["id"])
+        method = call["method"][len(METHOD_PREFIX):]
+        handler = getattr(self, "_" + method, None)
+        if handler is None:
+            return {"jsonrpc": "2.0", "id": call["id"],
+                    "error": {"code": -32601, "message": "Method not found"}}
+        return {"jsonrpc": "2.0", "id": call["id"], "result": handler(*call["params"])}
+
+    def _published(self, hour):
+        return self.published_until is None or hour < self.published_until
+
+    def _entries(self, start, end, value):
+        return [
+            {
+                "start": hour.strftime(TIME_FORMAT),
+                "end": (hour + timedelta(hours=1)).strftime(TIME_FORMAT),
+                "value": value(hour),
+            }
+            for hour in _hours(start, end)
+            if self._published(hour)
+        ]
+
+    def _spot(self, hour):
+        return self.fixtures["spot_hourly"][hour.hour]
+
+    def _total(self, hour):
+        return round(self._spot(hour) + self.fixtures["tariff_hourly"][hour.hour], 5)
+
+    def _getMeteringPoints(self):
+        return self.fixtures["metering_points"]
+
+    def _getPrice(self, price_code, start, end):
+        return [
+            dict(entry, currency=self.fixtures["currency"],
+                 country=self.fixtures["country"], priceCode=price_code)
+            for entry in self._entries(start, end, self._spot)
+        ]
+
+    def _getTotalKwHourlyPrice(self, mpid, start, end):
+        return self._entries(start, end, self._total)
+
+    def _getTotalKwHPrice(self, mpid, start, end):
+        hours = list(_hours(start, end))
+        if not hours or not self._published(hours[0]):
+            return None
+        return {"value": self._total(hours[0]), "currency": self.fixtures["currency"],
+                "country": self.fixtures["country"]}
+
+    def _getHourlyCo2Intensity(self, area, start, end):
+        return [
+            {"start": entry["start"], "end": entry["end"],
+             "carbonIntensity": entry["value"], "priceArea": area}
+            for entry in self._entries(
+                start, end, lambda hour: self.fixtures["co2_hourly"][hour.hour])
+        ]
+
+
+async def _serve(args):
+    server = FakeBarryServer(latency=args.latency, error_rate=args.error_rate,
+                             reject_batches=args.reject_batches)
+    print("Serving on", await server.start(args.host, args.port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reject-batches", action="store_true")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
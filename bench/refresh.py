@@ -0,0 +1,152 @@
+"""Benchmark of the refresh path against the local fake Barry server.
+
+Measures, for a number of metering points:
+
+- end-to-end latency of a cold coordinator refresh of today and
+  tomorrow, batched and with one request per call
+- HTTP requests and JSON-RPC calls per refresh cycle
+- CPU time of the per-tick work a sensor does on the cached series
+- memory held per metering point by the caches and mapped entries
+
+Run from the repository root with Home Assistant installed:
+
+    python bench/refresh.py --meters 4 --latency 0.05
+"""
+import argparse
+import asyncio
+from datetime import time
+import os
+import statistics
+import sys
+import tempfile
+import time as timer
+import tracemalloc
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_barry import FakeBarryServer  # noqa: E402
+from custom_components.barry.coordinator import (  # noqa: E402
+    TODAY,
+    TOMORROW,
+    BarryCoordinator,
+)
+from custom_components.barry.pybarry import AsyncBarry  # noqa: E402
+from custom_components.barry.sensor import BarryCo2Sensor, BarrySensor  # noqa: E402
+from homeassistant.core import HomeAssistant  # noqa: E402
+from homeassistant.util import dt as dt_util  # noqa: E402
+
+PUBLICATION = time(13)
+TICKS = 200
+
+
+def _meters(server, count):
+    points = server.fixtures["metering_points"]
+    return [
+        (str(int(points[i % len(points)]["mpid"]) + i // len(points) * 100),
+         points[i % len(points)]["priceCode"])
+        for i in range(count)
+    ]
+
+
+def _coordinator(hass, session, server, meters, batch):
+    api = AsyncBarry(session, batch=batch, tz=dt_util.DEFAULT_TIME_ZONE)
+    api.endpoint = server.url
+    coordinator = BarryCoordinator(hass, api, PUBLICATION, "bench")
+    for mpid, price_code in meters:
+        coordinator.async_subscribe(mpid, price_code, lambda: None)
+    return coordinator
+
+
+async def bench_refresh(hass, session, server, meters, rounds):
+    for batch in (True, False):
+        latencies = []
+        for _ in range(rounds):
+            coordinator = _coordinator(hass, session, server, meters, batch)
+            server.reset_counters()
+            started = timer.perf_counter()
+            await coordinator.async_refresh(windows=[TODAY, TOMORROW])
+            latencies.append(timer.perf_counter() - started)
+        cold = (server.requests, server.calls)
+
+        server.reset_counters()
+        await coordinator.async_refresh(windows=[TODAY, TOMORROW])
+        warm = (server.requests, server.calls)
+
+        print(f"refresh, {'batched' if batch else 'sequential':<10}"
+              f" {statistics.median(latencies) * 1e3:8.1f} ms median"
+              f"  {cold[0]:3d} requests / {cold[1]:3d} calls cold"
+              f"  {warm[0]:3d} / {warm[1]:3d} warm")
+    return coordinator
+
+
+def _sensors(coordinator, meters):
+    return [
+        BarrySensor(coordinator, price_code, mpid) for mpid, price_code in meters
+    ] + [
+        BarryCo2Sensor(coordinator, price_code, "bench")
+        for price_code in {price_code for _, price_code in meters}
+    ]
+
+
+def sensor_tick(sensors):
+    """The work the sensors do when the coordinator notifies them."""
+    for sensor in sensors:
+        sensor._update()  # pylint: disable=protected-access
+
+
+def bench_tick(coordinator, meters):
+    sensors = _sensors(coordinator, meters)
+    sensor_tick(sensors)
+    started = timer.process_time()
+    for _ in range(TICKS):
+        sensor_tick(sensors)
+    per_tick = (timer.process_time() - started) / TICKS
+    print(f"tick, {len(meters)} meters {per_tick * 1e6:12.1f} us CPU"
+          f"  {per_tick / len(meters) * 1e6:8.1f} us per meter")
+
+
+async def bench_memory(hass, session, server, meters):
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    coordinator = _coordinator(hass, session, server, meters, True)
+    await coordinator.async_refresh(windows=[TODAY, TOMORROW])
+    cached = tracemalloc.take_snapshot()
+    sensors = _sensors(coordinator, meters)
+    sensor_tick(sensors)
+    mapped = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    def size(snapshot, since):
+        return sum(stat.size_diff for stat in snapshot.compare_to(since, "filename"))
+
+    print(f"memory, caches {size(cached, baseline) / len(meters) / 1024:8.1f} KiB"
+          f" per meter, with mapped entries"
+          f" {size(mapped, baseline) / len(meters) / 1024:8.1f} KiB")
+
+
+async def main(args):
+    dt_util.set_default_time_zone(dt_util.get_time_zone("Europe/Copenhagen"))
+    server = FakeBarryServer(latency=args.latency, error_rate=args.error_rate,
+                             reject_batches=args.reject_batches)
+    await server.start()
+    meters = _meters(server, args.meters)
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        async with aiohttp.ClientSession() as session:
+            coordinator = await bench_refresh(
+                hass, session, server, meters, args.rounds)
+            bench_tick(coordinator, meters)
+            await bench_memory(hass, session, server, meters)
+    await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--meters", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reject-batches", action="store_true")
+    asyncio.run(main(parser.parse_args()))
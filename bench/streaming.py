@@ -0,0 +1,65 @@
+"""Benchmark of peak memory when fetching long total price ranges.
+
+Compares decoding the whole getTotalKwHourlyPrice response and mapping
+it to a series with streaming the range, chunked, straight into a
+series, for growing range lengths against the local fake Barry server.
+
+Run from the repository root with Home Assistant installed:
+
+    python bench/streaming.py
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+import os
+import sys
+import time
+import tracemalloc
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_barry import FakeBarryServer  # noqa: E402
+from custom_components.barry.pybarry import AsyncBarry, _utc_stamp  # noqa: E402
+from custom_components.barry.history import _async_fetch_series  # noqa: E402
+from custom_components.barry.series import PriceSeries  # noqa: E402
+
+MPID = "571313100000000001"
+END = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+async def whole(api, start, end):
+    return PriceSeries.from_entries(await api._call(
+        "getTotalKwHourlyPrice", [MPID, _utc_stamp(start), _utc_stamp(end)]))
+
+
+async def streamed(api, start, end):
+    return await _async_fetch_series(api, MPID, start, end)
+
+
+async def measure(func, api, days):
+    tracemalloc.start()
+    started = time.perf_counter()
+    series = await func(api, END - timedelta(days=days), END)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(series), elapsed, peak
+
+
+async def main():
+    server = FakeBarryServer()
+    await server.start()
+    async with aiohttp.ClientSession() as session:
+        api = AsyncBarry(session, batch=False)
+        api.endpoint = server.url
+        for days in (31, 90, 365, 730):
+            for name, func in (("whole", whole), ("streamed", streamed)):
+                slots, elapsed, peak = await measure(func, api, days)
+                print(f"{days:4d} days {name:<9} {slots:6d} slots"
+                      f" {elapsed * 1e3:8.1f} ms  {peak / 1024:8.1f} KiB peak")
+    await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
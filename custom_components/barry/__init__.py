@@ -1,10 +1,12 @@
 """The Barry App integration."""
+from functools import partial
 import logging
 from random import randint
-from datetime import datetime, timedelta
-from pytz import timezone
+from datetime import datetime, time, timedelta
 
-from .pybarry import Barry
+from .coordinator import BarryCoordinator
+from .metrics import Metrics
+from .pybarry import AsyncBarry
 
 import voluptuous as vol
 
@@ -12,15 +14,28 @@ from homeassistant import config_entries
 from homeassistant.const import CONF_ACCESS_TOKEN
 
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import Config, HomeAssistant
-from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.core import Config, HomeAssistant, callback
+from homeassistant.helpers import entity_registry as er
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
 from homeassistant.helpers.event import async_call_later, async_track_time_change
-
-from .const import DOMAIN, PRICE_CODE
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    CONF_FORECAST,
+    CONF_METERING_POINTS,
+    CONF_RESOLUTION,
+    DEFAULT_RESOLUTION,
+    DOMAIN,
+    MPID,
+    PRICE_CODE,
+    PUBLICATION_HOUR,
+    PUBLICATION_TZ,
+)
 from .events import async_track_time_change_in_tz
+from .history import async_import_statistics
+from .sensor import co2_unique_id
 
 PLATFORMS = ["sensor"]
-EVENT_NEW_DATA = "barry_update"
 RANDOM_MINUTE = randint(5, 15)
 RANDOM_SECOND = randint(0, 59)
 
@@ -33,50 +48,110 @@ class BarryData:
     def __init__(self, hass: HomeAssistant):
         self._hass = hass
         self.listeners = []
+        self.session = None
         self.barry_connection = None
+        self.coordinator = None
+        self.metrics = Metrics()
 
 
 async def _dry_setup(hass, entry) -> bool:
     """Setup"""
     _LOGGER.debug("Running _dry_setup")
 
-    if DOMAIN not in hass.data:
+    hass.data.setdefault(DOMAIN, {})
+    if entry.entry_id not in hass.data[DOMAIN]:
         _LOGGER.debug("Setting up integration: %s", entry)
         api = BarryData(hass)
 
-        api.barry_connection = Barry(
-            access_token=entry.data[CONF_ACCESS_TOKEN],
+        # The options flow can replace the token and metering points
+        config = {**entry.data, **entry.options}
+        resolution = config.get(CONF_RESOLUTION, DEFAULT_RESOLUTION)
+        forecast = config.get(CONF_FORECAST, False)
+        api.session = async_create_clientsession(hass)
+        api.barry_connection = AsyncBarry(
+            api.session,
+            access_token=config[CONF_ACCESS_TOKEN],
+            tz=dt_util.DEFAULT_TIME_ZONE,
+            metrics=api.metrics,
+        )
+        api.coordinator = BarryCoordinator(
+            hass,
+            api.barry_connection,
+            time(PUBLICATION_HOUR, RANDOM_MINUTE, RANDOM_SECOND),
+            entry.entry_id,
+            api.metrics,
+            learn=forecast,
         )
+        await api.coordinator.async_load()
 
-        hass.data[DOMAIN] = api
+        hass.data[DOMAIN][entry.entry_id] = api
 
-        async def new_hr(n):
-            """Callback to tell the sensors to update on a new hour."""
-            _LOGGER.debug("Called new_hr callback")
-            async_dispatcher_send(hass, EVENT_NEW_DATA)
+        async def new_slot(n):
+            """Callback to tell the sensors to update on a new price slot,
+            the prices are served from the cache unless the day is missing.
+            """
+            _LOGGER.debug("Called new_slot callback")
+            await api.coordinator.async_refresh()
 
         async def new_data_cb(n):
-            """Callback to fetch new data for tomorrows prices at 1300ish CET
-            and notify any sensors, about the new data
+            """Callback to start polling for tomorrows prices at 1300ish CET,
+            sensors are notified as the new data arrives
             """
             _LOGGER.debug("Called new_data_cb")
-            async_dispatcher_send(hass, EVENT_NEW_DATA)
+            await api.coordinator.async_poll_publication()
 
         cb_update_tomorrow = async_track_time_change_in_tz(
             hass,
             new_data_cb,
-            hour=13,
+            hour=PUBLICATION_HOUR,
             minute=RANDOM_MINUTE,
             second=RANDOM_SECOND,
-            tz=timezone("Europe/Stockholm"),
+            tz=PUBLICATION_TZ,
         )
 
-        cb_new_hr = async_track_time_change(
-            hass, new_hr, minute=0, second=0
+        cb_new_slot = async_track_time_change(
+            hass, new_slot, minute=list(range(0, 60, resolution)), second=0
+        )
+
+        async def import_statistics_cb():
+            """Callback to import the prices of the past hours into the
+            long-term statistics, resuming after the last imported hour.
+            """
+            _LOGGER.debug("Called import_statistics_cb")
+            if "recorder" not in hass.config.components:
+                return
+            for metering_point in config[CONF_METERING_POINTS]:
+                mpid = metering_point[MPID]
+                # The imported history also trains the price forecast
+                await async_import_statistics(
+                    hass, api.barry_connection, mpid,
+                    partial(api.coordinator.learn, mpid) if forecast else None)
+
+        @callback
+        def start_import_statistics(n=None):
+            # Owned by the entry, so an import still running is cancelled
+            # on unload before the session is closed
+            entry.async_create_background_task(
+                hass, import_statistics_cb(), f"{DOMAIN} statistics import")
+
+        cb_import_statistics = async_track_time_change(
+            hass,
+            start_import_statistics,
+            hour=0,
+            minute=RANDOM_MINUTE,
+            second=RANDOM_SECOND,
         )
+        start_import_statistics()
 
         api.listeners.append(cb_update_tomorrow)
-        api.listeners.append(cb_new_hr)
+        api.listeners.append(cb_new_slot)
+        api.listeners.append(cb_import_statistics)
+        api.listeners.append(api.coordinator.async_cancel_poll)
+
+        # Started after the publication time, the first poll picks up
+        # tomorrow if the initial refresh finds it missing
+        if api.coordinator.is_published(dt_util.utcnow()):
+            api.coordinator.async_schedule_poll()
 
     return True
 
@@ -91,6 +166,7 @@ async def async_setup(hass: HomeAssistant, config: ConfigEntry):
 async def async_setup_entry(hass, entry) -> bool:
     """Set up a config entry."""
     res = await _dry_setup(hass, entry)
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
 
     hass.async_create_task(
         hass.config_entries.async_forward_entry_setup(entry, "sensor")
@@ -104,16 +180,48 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     unload_ok = await hass.config_entries.async_forward_entry_unload(entry, "sensor")
 
     if unload_ok:
-        for unsub in hass.data[DOMAIN].listeners:
+        api = hass.data[DOMAIN].pop(entry.entry_id)
+        for unsub in api.listeners:
             unsub()
-        hass.data.pop(DOMAIN)
+        api.barry_connection.close()
+        if api.session is not None:
+            await api.session.close()
 
         return True
 
     return False
 
 
+async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Migrate old config entries."""
+    _LOGGER.debug("Migrating from version %s", entry.version)
+
+    if entry.version == 1:
+        # Version 1 held a single metering point
+        data = {
+            CONF_ACCESS_TOKEN: entry.data[CONF_ACCESS_TOKEN],
+            CONF_METERING_POINTS: [
+                {MPID: entry.data[MPID], PRICE_CODE: entry.data[PRICE_CODE]}
+            ],
+        }
+        hass.config_entries.async_update_entry(entry, data=data, version=2)
+
+    if entry.version == 2:
+        # The CO2 sensors were unique per price area, not per entry
+        @callback
+        def scope_co2_unique_id(entity_entry):
+            if not entity_entry.unique_id.startswith("barry_co2_"):
+                return None
+            area = entity_entry.unique_id[len("barry_co2_"):]
+            return {"new_unique_id": co2_unique_id(entry.entry_id, area)}
+
+        await er.async_migrate_entries(hass, entry.entry_id, scope_co2_unique_id)
+        hass.config_entries.async_update_entry(entry, version=3)
+
+    _LOGGER.debug("Migration to version %s successful", entry.version)
+    return True
+
+
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Reload config entry."""
-    await async_unload_entry(hass, entry)
-    await async_setup_entry(hass, entry)
+    await hass.config_entries.async_reload(entry.entry_id)
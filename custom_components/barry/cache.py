@@ -0,0 +1,61 @@
+"""Day-ahead price cache for the Barry integration."""
+from datetime import date
+import logging
+
+from .series import PriceSeries
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DayAheadCache:
+    """Price series keyed by (mpid or price code, local date).
+
+    Day-ahead prices for a date never change once they are published, so
+    an entry stays valid until its date has passed.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._series = {}
+
+    def get(self, key, day: date) -> PriceSeries:
+        return self._series.get((key, day))
+
+    def set(self, key, day: date, entries) -> bool:
+        """Cache the entries of a day, returns whether they changed it.
+
+        A series equal to the cached one is not replaced, so consumers
+        comparing series by identity see no change.
+        """
+        series = PriceSeries.from_entries(entries)
+        cached = self._series.get((key, day))
+        if cached is not None and (
+            (cached.start, cached.resolution, cached.values.tobytes())
+            == (series.start, series.resolution, series.values.tobytes())
+        ):
+            return False
+        _LOGGER.debug("Caching %d entries for %s on %s", len(entries), key, day)
+        self._series[(key, day)] = series
+        return True
+
+    def __contains__(self, item) -> bool:
+        return item in self._series
+
+    def as_dict(self) -> dict:
+        """Return the cache in a JSON serializable form."""
+        data = {}
+        for (key, day), series in self._series.items():
+            data.setdefault(key, {})[day.isoformat()] = series.as_dict()
+        return data
+
+    def load(self, data: dict) -> None:
+        """Fill the cache from the output of as_dict."""
+        for key, days in data.items():
+            for day, series in days.items():
+                self._series[(key, date.fromisoformat(day))] = \
+                    PriceSeries.from_dict(series)
+
+    def prune(self, today: date) -> None:
+        """Drop all series for days before today."""
+        for key in [key for key in self._series if key[1] < today]:
+            del self._series[key]
@@ -1,25 +1,52 @@
 """Adds config flow for Barry integration."""
 # pylint: disable=attribute-defined-outside-init
-import asyncio
 import logging
 
-from .pybarry import Barry, InvalidToken
+from .discovery import DISCOVERY_TTL, async_discover
+from .pybarry import InvalidToken
 import voluptuous as vol
 
 from homeassistant import config_entries
 from homeassistant.const import CONF_ACCESS_TOKEN
 from homeassistant.core import callback
-
-from .const import DOMAIN, PRICE_CODE, MPID
+from homeassistant.helpers import config_validation as cv
+
+from .const import (
+    CONF_FORECAST,
+    CONF_METERING_POINTS,
+    CONF_RESOLUTION,
+    DEFAULT_RESOLUTION,
+    DOMAIN,
+    MPID,
+    PRICE_CODE,
+    RESOLUTIONS,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
 
+def _configured_mpids(entries, exclude_entry_id=None) -> set:
+    return {
+        metering_point[MPID]
+        for entry in entries
+        if entry.entry_id != exclude_entry_id
+        for metering_point in {**entry.data, **entry.options}.get(
+            CONF_METERING_POINTS, [])
+    }
+
+
+def _metering_point_data(selected_meters) -> list:
+    return [
+        {MPID: meter["mpid"], PRICE_CODE: meter["priceCode"]}
+        for meter in selected_meters
+    ]
+
+
 @config_entries.HANDLERS.register(DOMAIN)
 class BarryConfigFlow(config_entries.ConfigFlow):
     """Handle a config flow for Barry integration."""
 
-    VERSION = 1
+    VERSION = 3
 
     @staticmethod
     @callback
@@ -29,24 +56,18 @@ class BarryConfigFlow(config_entries.ConfigFlow):
 
     async def async_step_user(self, user_input=None):
         """Handle the initial step."""
-        data_schema = vol.Schema({vol.Required(CONF_ACCESS_TOKEN): str})
-
-        if self._async_current_entries():
-            return self.async_abort(reason="already_configured")
+        data_schema = vol.Schema({
+            vol.Required(CONF_ACCESS_TOKEN): str,
+            vol.Required(CONF_RESOLUTION, default=DEFAULT_RESOLUTION): vol.In(
+                RESOLUTIONS),
+        })
 
         if user_input is not None:
             access_token = user_input[CONF_ACCESS_TOKEN].strip()
 
-            barry_connection = Barry(
-                access_token=access_token,
-            )
-
             errors = {}
             try:
-                loop = asyncio.get_event_loop()
-                await loop.run_in_executor(
-                    None, barry_connection.get_all_metering_points, True
-                )
+                self._discovered = await async_discover(self.hass, access_token)
             except InvalidToken:
                 errors[CONF_ACCESS_TOKEN] = "invalid_access_token"
             except Exception:  # pylint: disable=broad-except
@@ -58,8 +79,8 @@ class BarryConfigFlow(config_entries.ConfigFlow):
                     data_schema=data_schema,
                     errors=errors,
                 )
-            self.init_info = barry_connection
             self.access_token = access_token
+            self.resolution = user_input[CONF_RESOLUTION]
             return await self.async_step_metering_point()
 
         return self.async_show_form(
@@ -69,39 +90,36 @@ class BarryConfigFlow(config_entries.ConfigFlow):
 
     async def async_step_metering_point(self, user_input=None):
         """Handle the metering point selection step."""
-        mpids = await self.hass.async_add_executor_job(self.init_info.get_all_metering_points)
+        configured = _configured_mpids(self._async_current_entries())
+        mpids_display = self._discovered.choices(exclude=configured)
+        if not mpids_display:
+            return self.async_abort(reason="already_configured")
 
-        _LOGGER.debug("Got mpids %s", mpids)
-        mpids_display = [mpid["address"] for mpid in mpids]
         data_schema = vol.Schema(
-            {vol.Required("metering_point"): vol.In(mpids_display)}
+            {vol.Required(CONF_METERING_POINTS): cv.multi_select(mpids_display)}
         )
         if user_input:
             _LOGGER.debug("Got user input: %s", user_input)
-            selected_meter = next(
-                (item for item in mpids if item["address"] == user_input["metering_point"]), None)
+            selected_meters = self._discovered.select(
+                user_input[CONF_METERING_POINTS])
 
-            if selected_meter is None:
+            if not selected_meters:
                 return self.async_abort(reason="missing_meter")
 
-            _LOGGER.debug("Selected meter: %s", selected_meter["mpid"])
-
-            price_code = selected_meter["priceCode"]
-            _LOGGER.debug("Price code: %s", price_code)
-            mpid = selected_meter["mpid"]
-            _LOGGER.debug("MPID: %s", mpid)
+            selected_mpids = sorted(meter["mpid"] for meter in selected_meters)
+            _LOGGER.debug("Selected meters: %s", selected_mpids)
 
-            unique_id = "barry_" + str(mpid)
+            unique_id = "barry_" + "_".join(selected_mpids)
             _LOGGER.debug("Created unique ID: %s", unique_id)
             await self.async_set_unique_id(unique_id)
             self._abort_if_unique_id_configured()
 
             return self.async_create_entry(
-                title="Barry - " + selected_meter["mpid"],
+                title="Barry - " + ", ".join(selected_mpids),
                 data={
                     CONF_ACCESS_TOKEN: self.access_token,
-                    PRICE_CODE: price_code,
-                    MPID: mpid
+                    CONF_RESOLUTION: self.resolution,
+                    CONF_METERING_POINTS: _metering_point_data(selected_meters),
                 },
             )
 
@@ -115,33 +133,93 @@ class BarryOptionsFlowHandler(config_entries.OptionsFlow):
     """Option Flow for Barry component"""
 
     def __init__(self, config_entry):
-        self._access_token = config_entry.data[CONF_ACCESS_TOKEN] if CONF_ACCESS_TOKEN in config_entry.data else None
-        self._price_code = config_entry.data[PRICE_CODE] if PRICE_CODE in config_entry.data else None
-        self._mpid = config_entry.data[MPID] if MPID in config_entry.data else None
+        config = {**config_entry.data, **config_entry.options}
+        self._entry_id = config_entry.entry_id
+        self._access_token = config.get(CONF_ACCESS_TOKEN)
+        self._metering_points = config.get(CONF_METERING_POINTS, [])
+        self._resolution = config.get(CONF_RESOLUTION, DEFAULT_RESOLUTION)
+        self._forecast = config.get(CONF_FORECAST, False)
+        self._discovered = None
         self._errors = {}
 
     async def async_step_init(self, usser_input=None):
         return await self.async_step_user()
 
+    def _known_metering_points(self, access_token):
+        """The metering points the loaded entry fetched with this token
+        within DISCOVERY_TTL and their age, older ones could miss new meters.
+        """
+        api = self.hass.data.get(DOMAIN, {}).get(self._entry_id)
+        if api is None or access_token != self._access_token:
+            return None, None
+        age = api.coordinator.metering_points_age()
+        if age is None or age >= DISCOVERY_TTL:
+            return None, None
+        return api.coordinator.metering_points, age
+
     async def async_step_user(self, user_input=None):
+        self._errors = {}
         if user_input is not None:
-            self._access_token = user_input[CONF_ACCESS_TOKEN].strip()
+            access_token = user_input[CONF_ACCESS_TOKEN].strip()
+            try:
+                self._discovered = await async_discover(
+                    self.hass, access_token,
+                    *self._known_metering_points(access_token))
+            except InvalidToken:
+                self._errors[CONF_ACCESS_TOKEN] = "invalid_access_token"
+            except Exception:  # pylint: disable=broad-except
+                self._errors[CONF_ACCESS_TOKEN] = "unknown"
+            else:
+                self._access_token = access_token
+                self._resolution = user_input[CONF_RESOLUTION]
+                self._forecast = user_input[CONF_FORECAST]
+                return await self.async_step_metering_point()
 
         data_schema = {
             vol.Required(CONF_ACCESS_TOKEN, default=self._access_token): str,
+            vol.Required(CONF_RESOLUTION, default=self._resolution): vol.In(
+                RESOLUTIONS),
+            vol.Required(CONF_FORECAST, default=self._forecast): bool,
         }
+        return self.async_show_form(
+            step_id="user",
+            data_schema=vol.Schema(data_schema),
+            errors=self._errors,
+        )
+
+    async def async_step_metering_point(self, user_input=None):
+        """Re-select the metering points of the entry."""
+        self._errors = {}
+        configured = _configured_mpids(
+            self.hass.config_entries.async_entries(DOMAIN), self._entry_id)
+        mpids_display = self._discovered.choices(exclude=configured)
 
         if user_input is not None:
-            return self.async_create_entry(
-                title="Barry - " + self._mpid,
-                data={
-                    CONF_ACCESS_TOKEN: self._access_token,
-                    PRICE_CODE: self._price_code,
-                    MPID: self._mpid
-                },
-            )
+            selected_meters = self._discovered.select(
+                user_input[CONF_METERING_POINTS])
+            if selected_meters:
+                return self.async_create_entry(
+                    title="Barry - " + ", ".join(
+                        meter["mpid"] for meter in selected_meters),
+                    data={
+                        CONF_ACCESS_TOKEN: self._access_token,
+                        CONF_METERING_POINTS: _metering_point_data(selected_meters),
+                        CONF_RESOLUTION: self._resolution,
+                        CONF_FORECAST: self._forecast,
+                    },
+                )
+            self._errors[CONF_METERING_POINTS] = "missing_meter"
+
+        selected = [
+            metering_point[MPID] for metering_point in self._metering_points
+            if metering_point[MPID] in mpids_display
+        ]
+        data_schema = {
+            vol.Required(CONF_METERING_POINTS, default=selected): cv.multi_select(
+                mpids_display),
+        }
         return self.async_show_form(
-            step_id="user",
+            step_id="metering_point",
             data_schema=vol.Schema(data_schema),
             errors=self._errors,
         )
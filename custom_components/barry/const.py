@@ -1,7 +1,43 @@
 """Constants for the Barry API integration."""
+from datetime import time, timedelta
+
+from homeassistant.util import dt as dt_util
 
 # This is the internal name of the integration, it should also match the directory
 # name for the integration.
 DOMAIN = "barry"
 PRICE_CODE = "price_code"
 MPID = "mpid"
+CONF_METERING_POINTS = "metering_points"
+CONF_RESOLUTION = "resolution"
+CONF_FORECAST = "forecast"
+
+# Length of a price slot in minutes
+RESOLUTIONS = (60, 15)
+DEFAULT_RESOLUTION = 60
+
+# How far ahead of now the horizon sensor reaches, forecasting the hours
+# after the known prices
+HORIZON = timedelta(hours=48)
+
+# Nord Pool publishes the day-ahead prices for tomorrow around 13:00 CET.
+PUBLICATION_TZ = dt_util.get_time_zone("Europe/Stockholm")
+PUBLICATION_HOUR = 13
+
+SERVICE_FIND_CHEAPEST_WINDOW = "find_cheapest_window"
+# Supported feature of the sensors the service can target
+SUPPORT_FIND_CHEAPEST_WINDOW = 1
+ATTR_DURATION = "duration"
+ATTR_CONTIGUOUS = "contiguous"
+ATTR_EARLIEST_START = "earliest_start"
+ATTR_DEADLINE = "deadline"
+DEFAULT_WINDOW_DURATION = timedelta(hours=3)
+
+# Named windows of the day as local [start, end) times, None is midnight
+# ending the day. They are applied by time, so they hold on DST days and
+# at any price resolution.
+PRICE_WINDOWS = {
+    "off_peak_1": (time(0), time(8)),
+    "peak": (time(9), time(17)),
+    "off_peak_2": (time(20), None),
+}
@@ -0,0 +1,419 @@
+"""Shared data coordinator for the Barry integration."""
+import asyncio
+from datetime import datetime, time, timedelta
+import logging
+from time import monotonic
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .cache import DayAheadCache
+from .discovery import DISCOVERY_TTL
+from .series import PriceSeries
+from .const import DOMAIN, PUBLICATION_TZ
+from .forecast import PriceProfile
+from .metrics import Metrics
+from .pybarry import AsyncBarry, CircuitOpenError, InvalidToken, NoDataError
+
+_LOGGER = logging.getLogger(__name__)
+
+TODAY = 0
+TOMORROW = 1
+
+STORAGE_VERSION = 2
+SAVE_DELAY = 10
+
+# Leaves room for the client to retry a call
+FETCH_TIMEOUT = 60
+# Seconds between fetches of a series that ended before now
+REFETCH_INTERVAL = 3600
+
+# Seconds between polls for tomorrow's prices after the publication time
+PUBLICATION_POLL_DELAYS = (60, 60, 120, 120, 300, 300, 600, 900, 1800, 3600)
+
+
+class BarryStore(Store):
+    """Store for the coordinator cache, migrating older layouts."""
+
+    async def _async_migrate_func(self, old_major_version, old_minor_version, old_data):
+        if old_major_version < 2:
+            # Version 1 stored the series as the raw entry dicts
+            for cache in ("total_prices", "spot_prices"):
+                old_data[cache] = {
+                    key: {
+                        day: PriceSeries.from_entries(entries).as_dict()
+                        for day, entries in days.items()
+                    }
+                    for key, days in old_data.get(cache, {}).items()
+                }
+        return old_data
+
+
+class BarryCoordinator:
+    """Fetch data for one Barry account and fan it out to subscribers.
+
+    Entities subscribe with the metering point and price code they read,
+    the CO2 intensity is fetched for the area of every price code. Total
+    price, spot price and CO2 series are cached per local date, so a refresh
+    only calls the API for days that are missing from the cache, and
+    tomorrow is only requested once it can have been published.
+
+    The cache is persisted per config entry, so entities get their state
+    from disk right after a restart and only missing days are fetched.
+    Total prices only train the price profiles when learn is set, for the
+    forecast option.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        api: AsyncBarry,
+        publication: time,
+        entry_id: str,
+        metrics: Metrics = None,
+        learn: bool = False,
+    ) -> None:
+        self.hass = hass
+        self.api = api
+        self.publication = publication
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.total_prices = DayAheadCache("total_prices")
+        self.spot_prices = DayAheadCache("spot_prices")
+        self.co2_intensity = DayAheadCache("co2_intensity")
+        self.metering_points = None
+        self.metering_points_fetched = None
+        self.profiles = {}
+        self._learn = learn
+        self._unpublished = set()
+        self._refetched = {}
+        self._cancel_poll = None
+        self._subscribers = []
+        self._lock = asyncio.Lock()
+        self._store = BarryStore(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}")
+
+    async def async_load(self) -> None:
+        """Load the cached data stored by a previous run."""
+        data = await self._store.async_load()
+        if not data:
+            return
+        _LOGGER.debug("Loaded stored data")
+        self.total_prices.load(data.get("total_prices", {}))
+        self.spot_prices.load(data.get("spot_prices", {}))
+        self.co2_intensity.load(data.get("co2_intensity", {}))
+        self.metering_points = data.get("metering_points")
+        fetched = data.get("metering_points_fetched")
+        self.metering_points_fetched = fetched and dt_util.parse_datetime(fetched)
+        # Profiles kept while the forecast was off are dropped on next save
+        if self._learn:
+            self.profiles = {
+                mpid: PriceProfile.from_dict(profile)
+                for mpid, profile in data.get("profiles", {}).items()
+            }
+
+    @callback
+    def _data_to_save(self) -> dict:
+        return {
+            "total_prices": self.total_prices.as_dict(),
+            "spot_prices": self.spot_prices.as_dict(),
+            "co2_intensity": self.co2_intensity.as_dict(),
+            "metering_points": self.metering_points,
+            "metering_points_fetched": self.metering_points_fetched
+            and self.metering_points_fetched.isoformat(),
+            "profiles": {
+                mpid: profile.as_dict() for mpid, profile in self.profiles.items()
+            },
+        }
+
+    def diagnostics(self) -> dict:
+        """Return the publication state and the cached days per series."""
+        return {
+            "publication": self.publication.isoformat(),
+            "polling_publication": self._cancel_poll is not None,
+            "unpublished": sorted(
+                f"{key}/{day.isoformat()}" for key, day in self._unpublished),
+            **{
+                cache.name: {
+                    key: sorted(days) for key, days in cache.as_dict().items()
+                }
+                for cache in (self.total_prices, self.spot_prices, self.co2_intensity)
+            },
+        }
+
+    @callback
+    def async_schedule_save(self) -> None:
+        self._store.async_delay_save(self._data_to_save, SAVE_DELAY)
+
+    @callback
+    def async_subscribe(self, mpid, price_code, update_callback) -> CALLBACK_TYPE:
+        """Register an entity callback, returns a function to unsubscribe."""
+        subscriber = (mpid, price_code, update_callback)
+        self._subscribers.append(subscriber)
+
+        @callback
+        def remove_subscriber() -> None:
+            self._subscribers.remove(subscriber)
+
+        return remove_subscriber
+
+    def _day(self, offset: int):
+        return dt_util.now().date() + timedelta(days=offset)
+
+    def has_data(self, mpid) -> bool:
+        return (mpid, self._day(TODAY)) in self.total_prices
+
+    def prices(self, mpid, offset: int):
+        return self.total_prices.get(mpid, self._day(offset))
+
+    def current_total_price(self, mpid):
+        series = self.prices(mpid, TODAY)
+        return series.value_at(dt_util.utcnow()) if series else None
+
+    def current_spot_price(self, price_code):
+        series = self.spot_prices.get(price_code, self._day(TODAY))
+        return series.value_at(dt_util.utcnow()) if series else None
+
+    def co2(self, price_code):
+        return self.co2_intensity.get(
+            AsyncBarry.co2_area(price_code), self._day(TODAY))
+
+    def current_co2_intensity(self, price_code):
+        """Intensity of the latest slot known at now, the series of
+        today only reaches up to the time it was fetched.
+        """
+        series = self.co2(price_code)
+        return series.latest_at(dt_util.utcnow()) if series else None
+
+    def is_published(self, now: datetime) -> bool:
+        """Return whether tomorrow's day-ahead prices should be out by now."""
+        return now.astimezone(PUBLICATION_TZ).time() >= self.publication
+
+    @callback
+    def learn(self, mpid, series: PriceSeries) -> None:
+        """Add the complete days of a total price series to the profile
+        of a metering point.
+        """
+        profile = self.profiles.setdefault(mpid, PriceProfile())
+        learned = profile.learn(series, dt_util.DEFAULT_TIME_ZONE)
+        if learned:
+            _LOGGER.debug("Learned %d days of %s", learned, mpid)
+            self.async_schedule_save()
+
+    def forecast(self, mpid, start: datetime, end: datetime) -> list:
+        """Forecast the total prices of a metering point in slots of the
+        cached series, an empty list until a day has been learned.
+        """
+        profile = self.profiles.get(mpid)
+        if profile is None:
+            return []
+        series = self.prices(mpid, TODAY)
+        return profile.forecast(
+            start, end, dt_util.DEFAULT_TIME_ZONE,
+            series.resolution if series else 3600)
+
+    @staticmethod
+    async def _deadline(coro):
+        """Run an API call within the deadline, the client limits the
+        requests in flight.
+        """
+        return await asyncio.wait_for(coro, FETCH_TIMEOUT)
+
+    async def _fetch(self, cache, key, offset, fetch, until_now=False) -> bool:
+        """Fetch a series unless it is cached, returns whether it was.
+
+        With until_now the series may not cover the whole day yet, and it
+        is fetched again once the cached one no longer covers now, at most
+        every REFETCH_INTERVAL seconds. A fetch returning the cached
+        series again counts as not fetched.
+        """
+        day = self._day(offset)
+        series = cache.get(key, day)
+        refetched = self._refetched.get((cache.name, key))
+        if series is not None and (
+            not until_now
+            or dt_util.utcnow().timestamp() < series.end
+            or (refetched is not None
+                and monotonic() - refetched < REFETCH_INTERVAL)
+        ):
+            self.metrics.record_cache(cache.name, True)
+            return False
+        if (key, day) in self._unpublished:
+            return False
+        self.metrics.record_cache(cache.name, False)
+        if until_now:
+            self._refetched[(cache.name, key)] = monotonic()
+        try:
+            series = await self._deadline(fetch(key, offset))
+        except NoDataError:
+            if offset == TOMORROW:
+                _LOGGER.debug("%s for %s not published yet", key, day)
+                self._unpublished.add((key, day))
+            else:
+                _LOGGER.warning("No data returned for %s on %s", key, day)
+            return False
+        except CircuitOpenError as err:
+            _LOGGER.debug("Not fetching %s for %s: %s", key, day, err)
+            return False
+        except asyncio.TimeoutError:
+            _LOGGER.debug("Fetching %s for %s timed out", key, day)
+            self.metrics.fetch_timeouts += 1
+            return False
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.debug("Fetching %s for %s failed: %s", key, day, err)
+            return False
+        changed = cache.set(key, day, series)
+        self.metrics.record_fetch(f"{cache.name}/{key}", dt_util.utcnow())
+        if not changed:
+            return False
+        if self._learn and cache is self.total_prices:
+            self.learn(key, cache.get(key, day))
+        self.async_schedule_save()
+        return True
+
+    async def _fetch_metering_points(self) -> bool:
+        try:
+            self.metering_points = await self._deadline(
+                self.api.get_all_metering_points())
+        except InvalidToken:
+            # A BaseException, it would end the refresh before the
+            # subscribers are notified
+            _LOGGER.warning("The access token was rejected")
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.debug("Fetching metering points failed: %s", err)
+        else:
+            self.metering_points_fetched = dt_util.utcnow()
+            self.metrics.record_fetch("metering_points", self.metering_points_fetched)
+            self.async_schedule_save()
+        return False
+
+    def metering_points_age(self):
+        """Seconds since the metering points were fetched, None if never."""
+        if self.metering_points is None or self.metering_points_fetched is None:
+            return None
+        return (dt_util.utcnow() - self.metering_points_fetched).total_seconds()
+
+    def _subscribed(self):
+        mpids = {mpid for mpid, _, _ in self._subscribers if mpid}
+        price_codes = {price_code for _, price_code, _ in self._subscribers}
+        return mpids, price_codes
+
+    def tomorrow_missing(self) -> bool:
+        """Return whether any subscribed series for tomorrow is missing."""
+        tomorrow = self._day(TOMORROW)
+        mpids, price_codes = self._subscribed()
+        return (
+            any((mpid, tomorrow) not in self.total_prices for mpid in mpids)
+            or any((price_code, tomorrow) not in self.spot_prices
+                   for price_code in price_codes)
+        )
+
+    @callback
+    def async_schedule_poll(self, attempt: int = 0) -> None:
+        """Poll for tomorrow's prices after the delay for an attempt, the
+        last delay repeating until the local day ends.
+        """
+        self.async_cancel_poll()
+        delay = PUBLICATION_POLL_DELAYS[
+            min(attempt, len(PUBLICATION_POLL_DELAYS) - 1)]
+        now = dt_util.now()
+        if (now + timedelta(seconds=delay)).date() != now.date():
+            _LOGGER.warning("Tomorrow's prices were not published after %d polls",
+                            attempt)
+            return
+
+        async def _poll(_now) -> None:
+            self._cancel_poll = None
+            await self.async_poll_publication(attempt)
+
+        self._cancel_poll = async_call_later(
+            self.hass, delay, _poll)
+
+    @callback
+    def async_cancel_poll(self) -> None:
+        if self._cancel_poll is not None:
+            self._cancel_poll()
+            self._cancel_poll = None
+
+    async def async_poll_publication(self, attempt: int = 0) -> None:
+        """Fetch only tomorrow's series, polling again with a growing delay
+        until all of them are published.
+        """
+        self.async_cancel_poll()
+        await self.async_refresh(publication=True, windows=(TOMORROW,))
+        if self.tomorrow_missing():
+            self.async_schedule_poll(attempt + 1)
+        else:
+            _LOGGER.debug("Got all of tomorrow's prices")
+
+    async def async_refresh(self, publication: bool = False, windows=None) -> None:
+        """Fill the cache with whatever the subscribers are missing and
+        notify them.
+
+        Without windows, today is refreshed and tomorrow once it can have
+        been published. A day that came back empty before it was published
+        is skipped until the next refresh for a publication.
+        """
+        async with self._lock:
+            started = monotonic()
+            if publication:
+                self._unpublished.clear()
+            today = self._day(TODAY)
+            self._unpublished = {
+                (key, day) for key, day in self._unpublished if day > today}
+            self.total_prices.prune(today)
+            self.spot_prices.prune(today)
+            self.co2_intensity.prune(today)
+
+            if windows is None:
+                windows = [TODAY]
+                if self.is_published(dt_util.utcnow()):
+                    windows.append(TOMORROW)
+
+            mpids, price_codes = self._subscribed()
+            co2_areas = set()
+            if TODAY in windows:
+                co2_areas = {AsyncBarry.co2_area(price_code)
+                             for price_code in price_codes}
+            _LOGGER.debug("Refreshing mpids %s and price codes %s for %s",
+                          mpids, price_codes, windows)
+
+            # Issued together so the client can batch them, today first
+            # so the current prices are applied as soon as they arrive
+            fetches = []
+            for window in windows:
+                fetches.extend(
+                    self._fetch(self.total_prices, mpid, window,
+                                self.api.get_total_prices_offset)
+                    for mpid in mpids
+                )
+                fetches.extend(
+                    self._fetch(self.spot_prices, price_code, window,
+                                self.api.get_spot_prices_offset)
+                    for price_code in price_codes
+                )
+            fetches.extend(
+                self._fetch(self.co2_intensity, area, TODAY,
+                            self.api.get_co2_intensity_offset, until_now=True)
+                for area in co2_areas
+            )
+            # Kept fresh enough for the options flow to reuse, in the same
+            # batch as the prices
+            age = self.metering_points_age()
+            if TODAY in windows and (age is None or age >= DISCOVERY_TTL):
+                fetches.append(self._fetch_metering_points())
+
+            notified = False
+            for fetched in asyncio.as_completed(fetches):
+                if await fetched:
+                    self.async_update_listeners()
+                    notified = True
+            self.metrics.record_refresh(monotonic() - started, dt_util.utcnow())
+
+        if not notified:
+            self.async_update_listeners()
+
+    @callback
+    def async_update_listeners(self) -> None:
+        for _, _, update_callback in list(self._subscribers):
+            update_callback()
@@ -0,0 +1,29 @@
+"""Diagnostics support for the Barry integration."""
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_ACCESS_TOKEN
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+
+TO_REDACT = {CONF_ACCESS_TOKEN}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict:
+    """Return the metrics and cache state of a config entry."""
+    api = hass.data[DOMAIN][entry.entry_id]
+    return {
+        "entry": {
+            "data": async_redact_data(entry.data, TO_REDACT),
+            "options": async_redact_data(entry.options, TO_REDACT),
+        },
+        "metrics": api.metrics.as_dict(),
+        "client": {
+            "batch": api.barry_connection.batch,
+            "circuit_open": api.barry_connection.breaker.is_open,
+            "consecutive_failures": api.barry_connection.breaker.failures,
+        },
+        "coordinator": api.coordinator.diagnostics(),
+    }
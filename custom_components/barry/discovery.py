@@ -0,0 +1,78 @@
+"""Metering point discovery shared by the config and options flows."""
+import logging
+from time import monotonic
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from .const import DOMAIN
+from .pybarry import AsyncBarry
+
+DATA_DISCOVERY = f"{DOMAIN}_discovery"
+# Long enough to cover a flow, short enough to pick up new meters on retry
+DISCOVERY_TTL = 300
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class MeteringPoints:
+    """The metering points of an account, indexed by mpid and address."""
+
+    def __init__(self, metering_points: list, age: float = 0.0) -> None:
+        self.fetched = monotonic() - age
+        self.by_mpid = {}
+        self.by_address = {}
+        for metering_point in metering_points:
+            self.by_mpid[metering_point["mpid"]] = metering_point
+            self.by_address.setdefault(
+                metering_point["address"], []).append(metering_point)
+
+    def __len__(self) -> int:
+        return len(self.by_mpid)
+
+    def select(self, mpids) -> list:
+        """Return the known metering points among mpids, in their order."""
+        return [self.by_mpid[mpid] for mpid in mpids if mpid in self.by_mpid]
+
+    def choices(self, exclude=()) -> dict:
+        """Labels by mpid, with the mpid added where an address is shared."""
+        return {
+            mpid: (
+                metering_point["address"]
+                if len(self.by_address[metering_point["address"]]) == 1
+                else "%s (%s)" % (metering_point["address"], mpid)
+            )
+            for mpid, metering_point in self.by_mpid.items()
+            if mpid not in exclude
+        }
+
+
+async def async_discover(
+    hass: HomeAssistant, access_token: str, known: list = None,
+    known_age: float = None,
+) -> MeteringPoints:
+    """Return the metering points of an access token.
+
+    The result is shared between flows for DISCOVERY_TTL seconds since it
+    was fetched. Known metering points, e.g. those of a loaded entry, are
+    used instead of a call when nothing was cached, counting their age.
+    Raises InvalidToken for a bad token.
+    """
+    cache = hass.data.setdefault(DATA_DISCOVERY, {})
+    now = monotonic()
+    for token in [token for token, discovered in cache.items()
+                  if now - discovered.fetched >= DISCOVERY_TTL]:
+        del cache[token]
+    if access_token in cache:
+        return cache[access_token]
+
+    if known:
+        discovered = MeteringPoints(known, known_age or 0.0)
+    else:
+        barry_connection = AsyncBarry(
+            async_get_clientsession(hass), access_token=access_token)
+        discovered = MeteringPoints(
+            await barry_connection.get_all_metering_points())
+    _LOGGER.debug("Discovered %d metering points", len(discovered))
+    cache[access_token] = discovered
+    return discovered
@@ -1,8 +1,8 @@
 from datetime import datetime, timedelta
 from typing import Any, Callable, Optional
 
-from homeassistant.const import ATTR_NOW, EVENT_TIME_CHANGED
-from homeassistant.core import CALLBACK_TYPE, Event, HomeAssistant, callback
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_track_point_in_utc_time
 from homeassistant.loader import bind_hass
 from homeassistant.util import dt as dt_util
 from pytz import timezone
@@ -23,58 +23,56 @@ def async_track_utc_time_change(
     second: Optional[Any] = None,
     tz: Optional[Any] = None,
 ) -> CALLBACK_TYPE:
-    """Add a listener that will fire if time matches a pattern."""
-    # We do not have to wrap the function with time pattern matching logic
-    # if no pattern given
-    if all(val is None for val in (hour, minute, second)):
-
-        @callback
-        def time_change_listener(event: Event) -> None:
-            """Fire every time event that comes in."""
-            hass.async_run_job(action, event.data[ATTR_NOW])
-
-        return hass.bus.async_listen(EVENT_TIME_CHANGED, time_change_listener)
+    """Add a listener that will fire if time matches a pattern.
 
+    Instead of listening to every time_changed event, the next matching
+    time is calculated in the given timezone and a single timer is armed
+    for it, which is re-armed every time it fires.
+    """
     matching_seconds = dt_util.parse_time_expression(second, 0, 59)
     matching_minutes = dt_util.parse_time_expression(minute, 0, 59)
     matching_hours = dt_util.parse_time_expression(hour, 0, 23)
 
-    next_time = None
-
-    def calculate_next(now: datetime) -> None:
-        """Calculate and set the next time the trigger should fire."""
-        nonlocal next_time
-
+    def calculate_next(now: datetime) -> datetime:
+        """Calculate the next UTC time the trigger should fire."""
         localized_now = now.astimezone(tz) if tz else now
-        next_time = dt_util.find_next_time_expression_time(
-            localized_now, matching_seconds, matching_minutes, matching_hours
+        return dt_util.as_utc(
+            dt_util.find_next_time_expression_time(
+                localized_now, matching_seconds, matching_minutes, matching_hours
+            )
         )
 
-    # Make sure rolling back the clock doesn't prevent the timer from
-    # triggering.
-    last_now: Optional[datetime] = None
+    next_time = calculate_next(dt_util.utcnow())
+    cancel_timer: Optional[CALLBACK_TYPE] = None
 
     @callback
-    def pattern_time_change_listener(event: Event) -> None:
-        """Listen for matching time_changed events."""
-        nonlocal next_time, last_now
+    def pattern_time_change_listener(_: datetime) -> None:
+        """Fire the action and arm the timer for the next matching time."""
+        nonlocal next_time, cancel_timer
 
-        now = event.data[ATTR_NOW]
+        now = dt_util.utcnow()
+        if now >= next_time:
+            hass.async_run_job(action, now.astimezone(tz) if tz else now)
+            next_time = calculate_next(now + timedelta(seconds=1))
+        else:
+            # The clock was rolled back after the timer was armed
+            next_time = calculate_next(now)
 
-        if last_now is None or now < last_now:
-            # Time rolled back or next time not yet calculated
-            calculate_next(now)
+        cancel_timer = async_track_point_in_utc_time(
+            hass, pattern_time_change_listener, next_time
+        )
 
-        last_now = now
+    cancel_timer = async_track_point_in_utc_time(
+        hass, pattern_time_change_listener, next_time
+    )
 
-        if next_time <= now:
-            hass.async_run_job(action, now.astimezone(tz) if tz else now)
-            calculate_next(now + timedelta(seconds=1))
+    @callback
+    def unsub_time_change() -> None:
+        """Cancel the armed timer."""
+        if cancel_timer is not None:
+            cancel_timer()
 
-    # We can't use async_track_point_in_utc_time here because it would
-    # break in the case that the system time abruptly jumps backwards.
-    # Our custom last_now logic takes care of resolving that scenario.
-    return hass.bus.async_listen(EVENT_TIME_CHANGED, pattern_time_change_listener)
+    return unsub_time_change
 
 
 @callback
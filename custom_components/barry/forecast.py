@@ -0,0 +1,131 @@
+"""Price forecast beyond the day-ahead prices for the Barry integration."""
+from datetime import date, datetime, timedelta, tzinfo
+import math
+
+from .series import PriceSeries
+
+# Observations after which a cell turns into an exponential moving
+# average, so the profile follows the seasons
+PROFILE_WINDOW = 8
+# Learned days are remembered this long, older days are not offered again
+LEARNED_DAYS = 120
+# Half width of the two sided 80% band in standard deviations
+BAND_Z = 1.2816
+
+
+class RunningStats:
+    """Incremental mean and variance, Welford's update with the weight of
+    a new value bounded by PROFILE_WINDOW.
+    """
+
+    __slots__ = ("count", "mean", "variance")
+
+    def __init__(self, count: int = 0, mean: float = 0.0, variance: float = 0.0) -> None:
+        self.count = count
+        self.mean = mean
+        self.variance = variance
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        weight = 1 / min(self.count, PROFILE_WINDOW)
+        delta = value - self.mean
+        self.mean += weight * delta
+        self.variance = (1 - weight) * (self.variance + weight * delta * delta)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class PriceProfile:
+    """Weekday and hour profile of prices, learned one day at a time.
+
+    Every cell holds the deviation of an hour's price from the mean of
+    its day, the forecast adds it to the mean of the latest learned day.
+    Learning a day and forecasting a horizon both take time proportional
+    to their hours, never to the history seen.
+    """
+
+    def __init__(self) -> None:
+        self.cells = [RunningStats() for _ in range(7 * 24)]
+        self.learned = set()
+        self.level = None
+
+    def _cell(self, when: datetime) -> RunningStats:
+        return self.cells[when.weekday() * 24 + when.hour]
+
+    def learn(self, series: PriceSeries, tz: tzinfo) -> int:
+        """Learn the complete local days of a series not learned before,
+        returns the number of days learned.
+        """
+        days = {}
+        for position, value in enumerate(series.values):
+            if math.isnan(value):
+                continue
+            start = series.slot_start(position, tz)
+            hour = days.setdefault(start.date(), {}).setdefault(start.hour, [0.0, 0])
+            hour[0] += value
+            hour[1] += 1
+
+        learned = 0
+        for day, hours in sorted(days.items()):
+            # 23 hours on the day DST starts
+            if day in self.learned or len(hours) < 23:
+                continue
+            means = {hour: total / count for hour, (total, count) in hours.items()}
+            day_mean = sum(means.values()) / len(means)
+            for hour, mean in means.items():
+                self.cells[day.weekday() * 24 + hour].add(mean - day_mean)
+            self.learned.add(day)
+            if self.level is None or day >= self.level[0]:
+                self.level = (day, day_mean)
+            learned += 1
+
+        if learned:
+            oldest = max(self.learned) - timedelta(days=LEARNED_DAYS)
+            self.learned = {day for day in self.learned if day >= oldest}
+        return learned
+
+    def forecast(
+        self, start: datetime, end: datetime, tz: tzinfo, resolution: int = 3600
+    ) -> list:
+        """Start/end/value entries of resolution seconds from start to end,
+        with the lower and upper bound of the band. Hours learned less than
+        twice have no band.
+        """
+        if self.level is None:
+            return []
+        level = self.level[1]
+        entries = []
+        epoch = start.timestamp()
+        while epoch < end.timestamp():
+            slot_start = datetime.fromtimestamp(epoch, tz)
+            cell = self._cell(slot_start)
+            value = level + cell.mean
+            half_width = BAND_Z * cell.std if cell.count > 1 else None
+            entries.append({
+                "start": slot_start,
+                "end": datetime.fromtimestamp(epoch + resolution, tz),
+                "value": value,
+                "lower": None if half_width is None else value - half_width,
+                "upper": None if half_width is None else value + half_width,
+            })
+            epoch += resolution
+        return entries
+
+    def as_dict(self) -> dict:
+        """Return the profile in a JSON serializable form."""
+        return {
+            "cells": [[cell.count, cell.mean, cell.variance] for cell in self.cells],
+            "learned": sorted(day.isoformat() for day in self.learned),
+            "level": self.level and [self.level[0].isoformat(), self.level[1]],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PriceProfile":
+        profile = cls()
+        profile.cells = [RunningStats(*cell) for cell in data["cells"]]
+        profile.learned = {date.fromisoformat(day) for day in data["learned"]}
+        if data["level"]:
+            profile.level = (date.fromisoformat(data["level"][0]), data["level"][1])
+        return profile
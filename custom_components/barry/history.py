@@ -0,0 +1,131 @@
+"""Import of historical Barry prices into long-term statistics."""
+from datetime import datetime, timedelta, timezone
+import logging
+import math
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import (
+    async_add_external_statistics,
+    get_last_statistics,
+)
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN
+from .pybarry import AsyncBarry, BarryError
+from .series import PriceSeries, parse_epoch
+
+_LOGGER = logging.getLogger(__name__)
+
+# How far back a first import reaches, and the range inserted at once
+BACKFILL_DAYS = 90
+CHUNK_DAYS = 31
+
+UNIT = "DKK/kWh"
+
+
+def statistic_id(mpid) -> str:
+    return f"{DOMAIN}:total_price_{mpid}".lower()
+
+
+def _statistic(hour: float, values) -> StatisticData:
+    return StatisticData(
+        start=datetime.fromtimestamp(hour, timezone.utc),
+        mean=sum(values) / len(values),
+        min=min(values),
+        max=max(values),
+    )
+
+
+def _hourly_statistics(series: PriceSeries) -> list:
+    """Aggregate a price series to the hourly mean/min/max the recorder
+    keeps, skipping missing slots.
+    """
+    statistics = []
+    hour = None
+    values = []
+    for position, value in enumerate(series.values):
+        if math.isnan(value):
+            continue
+        start = series.start + position * series.resolution
+        start -= start % 3600
+        if start != hour:
+            if values:
+                statistics.append(_statistic(hour, values))
+            hour, values = start, []
+        values.append(value)
+    if values:
+        statistics.append(_statistic(hour, values))
+    return statistics
+
+
+async def _async_fetch_series(api: AsyncBarry, mpid, start, end) -> PriceSeries:
+    """Stream the total prices of a range straight into a series."""
+    series = PriceSeries(0.0, 3600)
+    async for entry in api.stream_total_prices_range(mpid, start, end):
+        series.append(
+            parse_epoch(entry["start"]), parse_epoch(entry["end"]), entry["value"])
+    return series
+
+
+async def _async_last_imported(hass: HomeAssistant, mpid):
+    """Return the end of the last imported hour, or None."""
+    last = await get_instance(hass).async_add_executor_job(
+        get_last_statistics, hass, 1, statistic_id(mpid), True, {"mean"}
+    )
+    if not last:
+        return None
+    end = last[statistic_id(mpid)][0]["end"]
+    if isinstance(end, (int, float)):
+        end = datetime.fromtimestamp(end, timezone.utc)
+    return end
+
+
+async def async_import_statistics(
+    hass: HomeAssistant, api: AsyncBarry, mpid, on_series=None
+) -> None:
+    """Import the total prices of a metering point up to the current hour.
+
+    Resumes after the last imported hour, or starts BACKFILL_DAYS back at
+    local midnight, and streams the range in chunks of CHUNK_DAYS local
+    days into a compact series, each inserted in one go as external
+    statistics. A failed request ends the import so no gap is left
+    behind. Every imported series is also handed to on_series, if given.
+    """
+    end = dt_util.utcnow().replace(minute=0, second=0, microsecond=0)
+    start = await _async_last_imported(hass, mpid)
+    if start is None:
+        # From local midnight, so chunks hold whole days to learn from
+        start = dt_util.start_of_local_day(
+            dt_util.as_local(end).date() - timedelta(days=BACKFILL_DAYS))
+
+    metadata = StatisticMetaData(
+        has_mean=True,
+        has_sum=False,
+        name=f"Barry total price {mpid}",
+        source=DOMAIN,
+        statistic_id=statistic_id(mpid),
+        unit_of_measurement=UNIT,
+    )
+
+    while start < end:
+        chunk_end = min(dt_util.start_of_local_day(
+            dt_util.as_local(start).date() + timedelta(days=CHUNK_DAYS)), end)
+        try:
+            series = await _async_fetch_series(api, mpid, start, chunk_end)
+        except BarryError as err:
+            # Stop here, the next import resumes from the last hour stored
+            _LOGGER.debug("Importing history for %s failed: %s", mpid, err)
+            return
+        if not series:
+            _LOGGER.debug("No history for %s from %s to %s",
+                          mpid, start, chunk_end)
+        else:
+            statistics = _hourly_statistics(series)
+            _LOGGER.debug("Importing %d hours for %s from %s",
+                          len(statistics), mpid, start)
+            async_add_external_statistics(hass, metadata, statistics)
+            if on_series is not None:
+                on_series(series)
+        start = chunk_end
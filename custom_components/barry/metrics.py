@@ -0,0 +1,162 @@
+"""Runtime metrics of the Barry API client and coordinator."""
+import asyncio
+from datetime import datetime
+
+# Upper bounds in seconds, the last bucket catches everything above
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Counts of observed durations per bucket, with their sum and max."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        bucket = 0
+        while bucket < len(self.buckets) and value > self.buckets[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def as_dict(self) -> dict:
+        labels = [f"le_{bucket}" for bucket in self.buckets] + ["inf"]
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "max": self.max,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class CallStats:
+    """Outcomes and latency of the calls to one API method."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.empty = 0
+        self.latency = Histogram()
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "empty": self.empty,
+            "latency": self.latency.as_dict(),
+        }
+
+
+def _is_timeout(err: BaseException) -> bool:
+    return isinstance(err, asyncio.TimeoutError) or isinstance(
+        err.__cause__, asyncio.TimeoutError)
+
+
+class Metrics:
+    """Counters shared by the client and the coordinator of an entry.
+
+    The client records every call and HTTP request, the coordinator the
+    cache lookups, successful fetches and refresh cycles.
+    """
+
+    def __init__(self) -> None:
+        self.calls = {}
+        self.requests = 0
+        self.retries = 0
+        self.fetch_timeouts = 0
+        self.cache = {}
+        self.last_success = {}
+        self.refresh = Histogram()
+        self.last_refresh = None
+        self.last_refresh_duration = None
+
+    def record_call(self, method: str, elapsed: float, result=None, error=None) -> None:
+        stats = self.calls.get(method)
+        if stats is None:
+            stats = self.calls[method] = CallStats()
+        stats.count += 1
+        stats.latency.observe(elapsed)
+        if error is not None:
+            if _is_timeout(error):
+                stats.timeouts += 1
+            else:
+                stats.errors += 1
+        elif not result:
+            stats.empty += 1
+
+    def record_request(self, retry: bool = False) -> None:
+        self.requests += 1
+        if retry:
+            self.retries += 1
+
+    def record_cache(self, name: str, hit: bool) -> None:
+        counts = self.cache.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+    def record_fetch(self, series: str, when: datetime) -> None:
+        self.last_success[series] = when
+
+    def record_refresh(self, duration: float, when: datetime) -> None:
+        self.refresh.observe(duration)
+        self.last_refresh = when
+        self.last_refresh_duration = duration
+
+    @property
+    def call_count(self) -> int:
+        return sum(stats.count for stats in self.calls.values())
+
+    @property
+    def errors(self) -> int:
+        return sum(stats.errors for stats in self.calls.values())
+
+    @property
+    def timeouts(self) -> int:
+        return self.fetch_timeouts + sum(
+            stats.timeouts for stats in self.calls.values())
+
+    @property
+    def mean_latency(self):
+        count = self.call_count
+        if not count:
+            return None
+        return sum(stats.latency.total for stats in self.calls.values()) / count
+
+    @property
+    def hit_ratio(self):
+        hits = sum(counts[0] for counts in self.cache.values())
+        lookups = sum(sum(counts) for counts in self.cache.values())
+        return hits / lookups if lookups else None
+
+    @property
+    def last_fetch(self):
+        return max(self.last_success.values(), default=None)
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "fetch_timeouts": self.fetch_timeouts,
+            "calls": {method: stats.as_dict() for method, stats in self.calls.items()},
+            "cache": {
+                name: {"hits": hits, "misses": misses}
+                for name, (hits, misses) in self.cache.items()
+            },
+            "last_success": {
+                series: when.isoformat() for series, when in self.last_success.items()
+            },
+            "refresh": self.refresh.as_dict(),
+            "last_refresh": self.last_refresh and self.last_refresh.isoformat(),
+            "last_refresh_duration": self.last_refresh_duration,
+        }
@@ -0,0 +1,74 @@
+"""Cheapest window search over Barry price series."""
+from datetime import datetime, timedelta
+from heapq import nsmallest
+from itertools import accumulate
+import math
+
+
+def _eligible(entries, earliest_start: datetime = None, deadline: datetime = None):
+    return [
+        entry for entry in entries
+        if (earliest_start is None or entry["start"] >= earliest_start)
+        and (deadline is None or entry["end"] <= deadline)
+    ]
+
+
+def _slot_count(entries, duration: timedelta) -> int:
+    resolution = entries[0]["end"] - entries[0]["start"]
+    return max(1, math.ceil(duration / resolution))
+
+
+def _window(slots) -> dict:
+    return {
+        "start": slots[0]["start"],
+        "end": slots[-1]["end"],
+        "average": sum(slot["value"] for slot in slots) / len(slots),
+        "slots": [
+            {"start": slot["start"], "end": slot["end"], "value": slot["value"]}
+            for slot in slots
+        ],
+    }
+
+
+def cheapest_window(
+    entries,
+    duration: timedelta,
+    contiguous: bool = True,
+    earliest_start: datetime = None,
+    deadline: datetime = None,
+):
+    """Find the cheapest slots covering duration within the constraints.
+
+    Entries are dicts with start, end and value sorted by start. A
+    contiguous window is found with a sliding prefix sum that restarts at
+    gaps in the series, otherwise the cheapest slots are picked
+    individually. Returns None if there are not enough eligible slots.
+    """
+    slots = _eligible(entries, earliest_start, deadline)
+    if not slots:
+        return None
+    count = _slot_count(slots, duration)
+    if count > len(slots):
+        return None
+
+    if not contiguous:
+        cheapest = nsmallest(count, range(len(slots)),
+                             key=lambda i: slots[i]["value"])
+        return _window([slots[i] for i in sorted(cheapest)])
+
+    prefix = list(accumulate((slot["value"] for slot in slots), initial=0.0))
+    best = None
+    run_start = 0
+    for end in range(1, len(slots) + 1):
+        if end > 1 and slots[end - 1]["start"] != slots[end - 2]["end"]:
+            run_start = end - 1
+        start = end - count
+        if start < run_start:
+            continue
+        total = prefix[end] - prefix[start]
+        if best is None or total < best[0]:
+            best = (total, start)
+
+    if best is None:
+        return None
+    return _window(slots[best[1]:best[1] + count])
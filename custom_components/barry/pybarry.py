@@ -1,11 +1,30 @@
+import asyncio
+import codecs
+import itertools
+import json
 import logging
+import random
+import re
+import aiohttp
 import pytz
-import requests
 
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
+from time import monotonic
 
 DEMO_TOKEN = ''
 DEFAULT_TIMEOUT = 15
+DEFAULT_RETRIES = 2
+MAX_PARALLEL_REQUESTS = 4
+BACKOFF_BASE = 1
+BACKOFF_MAX = 10
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 300
+STREAM_CHUNK_SIZE = 16384
+STREAM_RANGE = timedelta(days=7)
+ENDPOINT = "https://jsonrpc.barry.energy/json-rpc"
+METHOD_PREFIX = "co.getbarry.api.v1.OpenApiController."
+# JSON-RPC error codes of a server that does not accept batches
+BATCH_REJECTED = (-32600, -32700)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -14,134 +33,487 @@ class InvalidToken(BaseException):
     pass
 
 
-class Barry:
+class BarryError(Exception):
+    pass
+
+
+class BarryConnectionError(BarryError):
+    """The endpoint could not be reached or failed to answer."""
+
+
+class BarryResponseError(BarryError):
+    """The server answered a call with a JSON-RPC error."""
+
+
+class NoDataError(BarryError):
+    """The call succeeded but returned no data, e.g. before publication."""
+
+
+class CircuitOpenError(BarryError):
+    """Calls are suspended after repeated failures."""
+
+
+class CircuitBreaker:
+    """Suspend calls for a cooldown after a number of consecutive failures.
+
+    Once the cooldown has passed one call is let through again, if it
+    fails the breaker opens right away for another cooldown.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        return (self._opened_at is not None
+                and monotonic() - self._opened_at < self.cooldown)
+
+    def check(self):
+        if self.is_open:
+            raise CircuitOpenError(
+                'Suspended after %d failures' % self.failures)
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            _LOGGER.debug("Opening circuit after %d failures", self.failures)
+            self._opened_at = monotonic()
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _rpc_payload(method, params, request_id=0):
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": METHOD_PREFIX + method,
+        "params": params,
+    }
+
+
+def _check_status(response):
+    """Raise BarryConnectionError for a status worth retrying, server
+    errors and rate limiting.
+    """
+    if response.status >= 500 or response.status == 429:
+        raise BarryConnectionError('HTTP error %d' % response.status)
+
+
+def _utc_stamp(when: datetime):
+    return when.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _day_window(offset: int, tz=None):
+    """UTC range of a local day, from its midnight to the next one.
+
+    Both midnights are resolved separately in the timezone, so the range
+    is 23 or 25 hours long on DST changes. Without a timezone the
+    system's local time is used.
+    """
+    if tz is None:
+        day = datetime.now().date() + timedelta(days=offset)
+        start = datetime.combine(day, time()).astimezone()
+        end = datetime.combine(day + timedelta(days=1), time()).astimezone()
+    else:
+        day = datetime.now(tz).date() + timedelta(days=offset)
+        start = datetime.combine(day, time(), tzinfo=tz)
+        end = datetime.combine(day + timedelta(days=1), time(), tzinfo=tz)
+    return _utc_stamp(start), _utc_stamp(end)
+
+
+_RESULT_ARRAY = re.compile(r'"result"\s*:\s*\[')
+# Bodies up to this length are kept whole until the result array starts,
+# so an error answer can be decoded when the body ends
+_PREFIX_LIMIT = 4096
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+class _ResultParser:
+    """Incremental decoder of the items of a JSON-RPC result array.
+
+    Text is fed as it arrives and every complete item is returned right
+    away, only the undecoded tail of the body is kept. Items must be
+    objects, which cannot be decoded before they are complete. A response
+    without a result array yields no items and fails on close, unless its
+    result is null.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._in_result = False
+        self._done = False
+
+    def feed(self, text):
+        if self._done:
+            return []
+        self._buffer += text
+        if not self._in_result:
+            match = _RESULT_ARRAY.search(self._buffer)
+            if match is None:
+                if len(self._buffer) > _PREFIX_LIMIT:
+                    # Keep enough to find a key split between two chunks
+                    self._buffer = self._buffer[-64:]
+                return []
+            self._buffer = self._buffer[match.end():]
+            self._in_result = True
+
+        items = []
+        position = 0
+        while True:
+            position = _SEPARATORS.match(self._buffer, position).end()
+            if position == len(self._buffer):
+                break
+            if self._buffer[position] == ']':
+                self._done = True
+                break
+            try:
+                item, position = self._decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                # Incomplete item, wait for the rest
+                break
+            items.append(item)
+        self._buffer = self._buffer[position:]
+        return items
+
+    def close(self):
+        """Check the body has ended, raises BarryResponseError for an
+        error answer and BarryConnectionError for any other body without
+        a complete result array.
+        """
+        if self._in_result:
+            if not self._done:
+                raise BarryConnectionError('Truncated or invalid result array')
+            return
+        try:
+            body = json.loads(self._buffer)
+        except ValueError:
+            body = None
+        if isinstance(body, dict) and body.get('error') is not None:
+            raise BarryResponseError(body['error'])
+        if not isinstance(body, dict) or 'result' not in body \
+                or body['result'] is not None:
+            raise BarryConnectionError('No result array in the response')
+
+
+def _map_metering_points(result):
+    res = []
+    for data in result:
+        res.append({
+            "address": data['address']['formattedAddress'],
+            "mpid": data["mpid"],
+            "priceCode": data["priceCode"]
+        })
+    return res
+
+
+class AsyncBarry:
+    """Asyncio client for the Barry JSON-RPC API.
+
+    All calls go through the given aiohttp session, so connections to the
+    endpoint are pooled and kept alive between refreshes.
+
+    Calls issued in the same event loop iteration, e.g. through
+    asyncio.gather, are sent as one JSON-RPC batch request and the
+    responses are routed back to their callers by id. If the server
+    rejects a batch the client falls back to sequential calls. At most
+    max_parallel HTTP requests are in flight at a time.
+
+    Connection errors, timeouts, server errors, rate limiting and bodies
+    that are not JSON are retried with jittered exponential backoff. After repeated failed calls a circuit
+    breaker suspends calls for a while, raising CircuitOpenError.
+
+    Given a metrics object, every call is reported to its record_call
+    and every HTTP request to its record_request.
+    """
 
     def __init__(
             self,
+            session: aiohttp.ClientSession,
             access_token=DEMO_TOKEN,
             timeout=DEFAULT_TIMEOUT,
+            batch=True,
+            retries=DEFAULT_RETRIES,
+            tz=None,
+            metrics=None,
+            max_parallel=MAX_PARALLEL_REQUESTS,
     ):
-        self.timeout = timeout
+        self._session = session
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
         self.headers = {
             'Authorization': 'Bearer ' + access_token,
             'Content-Type': 'application/json',
         }
-        self.endpoint = "https://jsonrpc.barry.energy/json-rpc"
+        self.endpoint = ENDPOINT
+        self.batch = batch
+        self.retries = retries
+        self.tz = tz
+        self.breaker = CircuitBreaker()
+        self.metrics = metrics
+        self._ids = itertools.count(1)
+        self._pending = []
+        self._batches = {}
+        self._requests = asyncio.Semaphore(max_parallel)
 
-    @staticmethod
-    def hour_rounder(t):
-        # Rounds to nearest hour by adding a timedelta hour if minute >= 30
-        return (t.replace(second=0, microsecond=0, minute=0, hour=t.hour))
+    async def _post(self, payload):
+        self.breaker.check()
+        for attempt in range(self.retries + 1):
+            if self.metrics is not None:
+                self.metrics.record_request(retry=attempt > 0)
+            try:
+                async with self._requests, self._session.post(
+                        self.endpoint,
+                        headers=self.headers,
+                        json=payload,
+                        timeout=self.timeout,
+                ) as response:
+                    _check_status(response)
+                    try:
+                        json_res = await response.json(content_type=None)
+                    except ValueError as err:
+                        # e.g. the HTML page of a proxy or maintenance
+                        raise BarryConnectionError(
+                            'Invalid response, HTTP status %d'
+                            % response.status) from err
+                    if not isinstance(json_res, (dict, list)):
+                        raise BarryConnectionError(
+                            'Invalid response, HTTP status %d'
+                            % response.status)
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    BarryConnectionError) as err:
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise BarryConnectionError(str(err) or repr(err)) from err
+                delay = _backoff(attempt)
+                _LOGGER.debug("Call failed (%s), retrying in %.1fs", err, delay)
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return json_res
+
+    async def _stream(self, method, params):
+        """Make a single call and yield the items of its result array as
+        they are decoded from the response body.
+
+        Failures are retried like other calls as long as no item has been
+        yielded yet.
+        """
+        self.breaker.check()
+        _LOGGER.debug("Streaming %s with %s", method, params)
+        for attempt in range(self.retries + 1):
+            if self.metrics is not None:
+                self.metrics.record_request(retry=attempt > 0)
+            started = monotonic()
+            count = 0
+            try:
+                async with self._requests, self._session.post(
+                        self.endpoint,
+                        headers=self.headers,
+                        json=_rpc_payload(method, params),
+                        timeout=self.timeout,
+                ) as response:
+                    _check_status(response)
+                    parser = _ResultParser()
+                    decoder = codecs.getincrementaldecoder('utf-8')()
+                    async for chunk in response.content.iter_chunked(
+                            STREAM_CHUNK_SIZE):
+                        for item in parser.feed(decoder.decode(chunk)):
+                            count += 1
+                            yield item
+                    parser.feed(decoder.decode(b'', final=True))
+                    parser.close()
+            except BarryResponseError as err:
+                # An answer, asking again would get the same one
+                self.breaker.record_success()
+                if self.metrics is not None:
+                    self.metrics.record_call(
+                        method, monotonic() - started, error=err)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    BarryConnectionError) as err:
+                if count or attempt == self.retries:
+                    self.breaker.record_failure()
+                    if self.metrics is not None:
+                        self.metrics.record_call(
+                            method, monotonic() - started, error=err)
+                    raise BarryConnectionError(str(err) or repr(err)) from err
+                delay = _backoff(attempt)
+                _LOGGER.debug("Call failed (%s), retrying in %.1fs", err, delay)
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                if self.metrics is not None:
+                    self.metrics.record_call(
+                        method, monotonic() - started, result=count)
+                return
+
+    async def _call_single(self, method, params):
+        _LOGGER.debug("Calling %s with %s", method, params)
+        json_res = await self._post(_rpc_payload(method, params))
+        return json_res.get('result')
+
+    async def _call(self, method, params):
+        if self.metrics is None:
+            return await self._dispatch(method, params)
+        started = monotonic()
+        try:
+            result = await self._dispatch(method, params)
+        except Exception as err:
+            self.metrics.record_call(method, monotonic() - started, error=err)
+            raise
+        self.metrics.record_call(method, monotonic() - started, result=result)
+        return result
+
+    async def _dispatch(self, method, params):
+        if not self.batch:
+            return await self._call_single(method, params)
+
+        future = asyncio.get_running_loop().create_future()
+        if not self._pending:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._pending.append((method, params, future))
+        return await future
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._send_batch(pending))
+        # Held until done, the loop only keeps weak references to tasks
+        self._batches[task] = pending
+        task.add_done_callback(self._batches.pop)
+
+    def close(self):
+        """Cancel the calls in flight, e.g. before the session is closed."""
+        for task, pending in list(self._batches.items()):
+            task.cancel()
+            for _, _, future in pending:
+                future.cancel()
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending = []
+
+    async def _send_batch(self, pending):
+        if len(pending) == 1 or not self.batch:
+            for method, params, future in pending:
+                await self._resolve(future, self._call_single(method, params))
+            return
+
+        requests_by_id = {next(self._ids): call for call in pending}
+        _LOGGER.debug("Calling %s in one batch",
+                      [method for method, _, _ in pending])
+        try:
+            json_res = await self._post([
+                _rpc_payload(method, params, request_id)
+                for request_id, (method, params, _) in requests_by_id.items()
+            ])
+        except Exception as err:  # pylint: disable=broad-except
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(err)
+            return
+
+        if not isinstance(json_res, list):
+            error = json_res.get('error') if isinstance(json_res, dict) else None
+            if isinstance(error, dict) and error.get('code') in BATCH_REJECTED:
+                _LOGGER.debug("Batch rejected, falling back to single calls: %s",
+                              json_res)
+                self.batch = False
+                await self._send_batch(pending)
+                return
+            # Any other error, e.g. for the token, holds for every call
+            _LOGGER.debug("Batch failed: %s", json_res)
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_result(None)
+            return
+
+        for response in json_res:
+            call = requests_by_id.pop(response.get('id'), None)
+            if call is not None and not call[2].done():
+                call[2].set_result(response.get('result'))
+        for _, _, future in requests_by_id.values():
+            if not future.done():
+                future.set_result(None)
 
     @staticmethod
-    def get_currency(data):
-        if data.get('country') == 'DK' or data.get('currency') == 'DKK':
-            currency = 'kr./KWH'
+    async def _resolve(future, coro):
+        try:
+            result = await coro
+        except Exception as err:  # pylint: disable=broad-except
+            if not future.done():
+                future.set_exception(err)
         else:
-            currency = '€/KWH'
-        return currency
-
-    def get_current_co2_emission(self, price_code):
-        current_time = self.hour_rounder(
-            datetime.utcnow().replace(microsecond=0)).isoformat() + 'Z'
-        last_hour_date_time = self.hour_rounder(
-            (datetime.utcnow() - timedelta(hours=1)).replace(microsecond=0)).isoformat() + 'Z'
-
-        price_code = price_code.split('_')[-1]
-        data = '{ "jsonrpc": "2.0", "id": 0, "method": "co.getbarry.api.v1.OpenApiController.getHourlyCo2Intensity", "params": [ "%s", "%s", "%s" ] }' % (
-            price_code, last_hour_date_time, current_time)
-        response = requests.post(
-            self.endpoint, headers=self.headers, data=data)
-        json_res = response.json()
-        result = json_res.get('result')
-        if result:
-            result = result[0]
-            value = result['carbonIntensity']
-            return value, 'gCO2/kWh'
-        else:
-            return 'NA', '-'
-
-    def get_current_spot_price(self, price_code):
-        current_time = self.hour_rounder(
-            datetime.utcnow().replace(microsecond=0)).isoformat() + 'Z'
-        next_hour_date_time = self.hour_rounder(
-            (datetime.utcnow() + timedelta(hours=1)).replace(microsecond=0)).isoformat() + 'Z'
-
-        data = '{ "jsonrpc": "2.0", "id": 0, "method": "co.getbarry.api.v1.OpenApiController.getPrice", "params": [ "%s", "%s", "%s" ] }' % (
-            price_code, current_time, next_hour_date_time)
-        response = requests.post(
-            self.endpoint, headers=self.headers, data=data)
-        json_res = response.json()
-        result = json_res.get('result')
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def co2_area(price_code):
+        return price_code.split('_')[-1]
+
+    async def get_co2_intensity_offset(self, price_code, offset: int):
+        result = await self._call(
+            "getHourlyCo2Intensity",
+            [self.co2_area(price_code), *_day_window(offset, self.tz)])
         if result:
-            result = result[0]
-            value, currency = result['value'], self.get_currency(result)
-            return {
-                "value": value,
-                "currency": currency
-            }
-
-    def get_current_total_price(self, mpid):
-        current_time = self.hour_rounder(
-            datetime.utcnow().replace(microsecond=0)).isoformat() + 'Z'
-        next_hour_date_time = self.hour_rounder(
-            (datetime.utcnow() + timedelta(hours=1)).replace(microsecond=0)).isoformat() + 'Z'
-
-        data = '{ "jsonrpc": "2.0", "id": 0, "method": "co.getbarry.api.v1.OpenApiController.getTotalKwHPrice", "params": [ "%s", "%s", "%s" ] }' % (
-            mpid, current_time, next_hour_date_time)
-        response = requests.post(
-            self.endpoint, headers=self.headers, data=data)
-        json_res = response.json()
-        result = json_res.get('result')
+            return [
+                {
+                    "start": entry['start'],
+                    "end": entry['end'],
+                    "value": entry['carbonIntensity'],
+                }
+                for entry in result
+            ]
+        raise NoDataError('No data returned')
+
+    async def get_spot_prices_offset(self, price_code, offset: int):
+        result = await self._call(
+            "getPrice", [price_code, *_day_window(offset, self.tz)])
         if result:
-            value, currency = result['value'], self.get_currency(result)
-            return {
-                "value": value,
-                "currency": currency
-            }
-
-    def get_total_prices_offset(self, mpid, offset: int):
-        dateNowMidnight = datetime.today().replace(
-            second=0, microsecond=0, minute=0, hour=0)
-        dtStart = str((dateNowMidnight + timedelta(days=offset)).astimezone(pytz.utc).date()
-                      ) + "T" + str(dateNowMidnight.astimezone(pytz.utc).time()) + "Z"
-        dtEnd = str((dateNowMidnight + timedelta(days=offset+1)).astimezone(pytz.utc).date()
-                    ) + "T" + str(dateNowMidnight.astimezone(pytz.utc).time()) + "Z"
-
-        data = '{ "jsonrpc": "2.0", "id": 0, "method": "co.getbarry.api.v1.OpenApiController.getTotalKwHourlyPrice", "params": [ "%s", "%s", "%s" ] }' % (
-            mpid, dtStart, dtEnd)
-        response = requests.post(
-            self.endpoint, headers=self.headers, data=data)
-        json_res = response.json()
-        result = json_res.get('result')
+            return result
+        raise NoDataError('No data returned')
+
+    async def get_total_prices_offset(self, mpid, offset: int):
+        result = await self._call(
+            "getTotalKwHourlyPrice", [mpid, *_day_window(offset, self.tz)])
         if result:
             return result
-        else:
-            raise Exception('No data returned')
+        raise NoDataError('No data returned')
 
-    def get_total_prices_today(self, mpid):
-        return self.get_total_prices_offset(mpid, 0)
+    async def stream_total_prices_range(
+            self, mpid, start: datetime, end: datetime, chunk=STREAM_RANGE):
+        """Yield the total price entries for a range of aware datetimes
+        as they are decoded.
 
-    def get_total_prices_tomorrow(self, mpid):
-        return self.get_total_prices_offset(mpid, 1)
+        The range is requested chunk at a time, so memory use does not
+        grow with its length.
+        """
+        while start < end:
+            chunk_end = min(start + chunk, end)
+            async for entry in self._stream(
+                    "getTotalKwHourlyPrice",
+                    [mpid, _utc_stamp(start), _utc_stamp(chunk_end)]):
+                yield entry
+            start = chunk_end
 
-    def get_all_metering_points(self, check_token=False):
-        data = '{ "jsonrpc": "2.0", "id": 0, "method": "co.getbarry.api.v1.OpenApiController.getMeteringPoints", "params": [] }'
-        response = requests.post(
-            self.endpoint, headers=self.headers, data=data)
-        json_res = response.json()
-        if json_res.get('result'):
+    async def get_total_prices_today(self, mpid):
+        return await self.get_total_prices_offset(mpid, 0)
+
+    async def get_total_prices_tomorrow(self, mpid):
+        return await self.get_total_prices_offset(mpid, 1)
+
+    async def get_all_metering_points(self, check_token=False):
+        result = await self._call("getMeteringPoints", [])
+        if result:
             if check_token:
                 return True
-            result = json_res['result']
-            res = []
-            for data in result:
-                res.append({
-                    "address": data['address']['formattedAddress'],
-                    "mpid": data["mpid"],
-                    "priceCode": data["priceCode"]
-                })
-
-            return res
-        else:
-            raise InvalidToken('Invalid access token')
+            return _map_metering_points(result)
+        raise InvalidToken('Invalid access token')
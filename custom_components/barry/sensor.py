@@ -3,63 +3,222 @@ import logging
 import math
 
 from datetime import timedelta
-from operator import itemgetter
-from statistics import mean
 
+import voluptuous as vol
+
+from homeassistant.const import EntityCategory
+from homeassistant.core import SupportsResponse, callback
+from homeassistant.helpers import config_validation as cv, entity_platform
+from homeassistant.helpers.device_registry import DeviceEntryType
 from homeassistant.helpers.entity import Entity
-from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.util import dt as dt_utils
 
-import dateutil.parser
-
-from .const import DOMAIN, PRICE_CODE, MPID
-
-from . import EVENT_NEW_DATA
+from .const import (
+    ATTR_CONTIGUOUS,
+    ATTR_DEADLINE,
+    ATTR_DURATION,
+    ATTR_EARLIEST_START,
+    CONF_FORECAST,
+    CONF_METERING_POINTS,
+    DEFAULT_WINDOW_DURATION,
+    DOMAIN,
+    HORIZON,
+    MPID,
+    PRICE_CODE,
+    PRICE_WINDOWS,
+    SERVICE_FIND_CHEAPEST_WINDOW,
+    SUPPORT_FIND_CHEAPEST_WINDOW,
+)
+from .coordinator import TODAY, TOMORROW
+from .planner import cheapest_window
+from .pybarry import AsyncBarry
+from .series import local_time
 
 _LOGGER = logging.getLogger(__name__)
 
-
-def _dry_setup(hass, config, add_devices, discovery_info=None):
-    """Setup platform"""
-    _LOGGER.debug("Dumping config %r", config)
-    _LOGGER.debug("Dumping hass data", hass.data)
-    barry_connection = hass.data[DOMAIN].barry_connection
-    price_code = config[PRICE_CODE]
-    meter_id = config[MPID]
-    sensor = BarrySensor(
-        barry_connection,
-        price_code,
-        meter_id
-    )
-
-    add_devices([sensor])
-
-
-async def async_setup_platform(hass, config, add_devices, discovery_info=None) -> None:
-    _LOGGER.debug("Setting up platform")
-    _dry_setup(hass, config, add_devices)
-    return True
+# Only the diagnostic sensors poll, reading the in-memory metrics
+SCAN_INTERVAL = timedelta(minutes=1)
+
+
+def co2_unique_id(entry_id, area) -> str:
+    """Unique id of the CO2 sensor of a price area in an entry, areas are
+    shared between entries.
+    """
+    return ("barry_co2_%s_%s" % (entry_id, area)).lower().replace(" ", "_")
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+# Diagnostic sensors over the metrics of an entry, by key: name, unit,
+# device class, state and attributes
+DIAGNOSTICS = {
+    "api_latency": (
+        "API latency", "ms", "duration",
+        lambda metrics: _ms(metrics.mean_latency),
+        lambda metrics: {
+            "methods": {
+                method: stats.as_dict() for method, stats in metrics.calls.items()
+            },
+        },
+    ),
+    "api_errors": (
+        "API errors", None, None,
+        lambda metrics: metrics.errors + metrics.timeouts,
+        lambda metrics: {
+            "errors": metrics.errors,
+            "timeouts": metrics.timeouts,
+            "requests": metrics.requests,
+            "retries": metrics.retries,
+            "empty": sum(stats.empty for stats in metrics.calls.values()),
+        },
+    ),
+    "cache_hit_ratio": (
+        "Cache hit ratio", "%", None,
+        lambda metrics: None if metrics.hit_ratio is None
+        else round(metrics.hit_ratio * 100, 1),
+        lambda metrics: {
+            name: {"hits": hits, "misses": misses}
+            for name, (hits, misses) in metrics.cache.items()
+        },
+    ),
+    "refresh_duration": (
+        "Refresh duration", "ms", "duration",
+        lambda metrics: _ms(metrics.last_refresh_duration),
+        lambda metrics: {
+            "last_refresh": metrics.last_refresh,
+            "refreshes": metrics.refresh.count,
+            "mean": _ms(metrics.refresh.mean),
+            "max": _ms(metrics.refresh.max),
+        },
+    ),
+    "last_fetch": (
+        "Last successful fetch", None, "timestamp",
+        lambda metrics: metrics.last_fetch and metrics.last_fetch.isoformat(),
+        lambda metrics: {"series": dict(metrics.last_success)},
+    ),
+}
 
 
 async def async_setup_entry(hass, config_entry, async_add_devices):
-    """Set up the Barry sensor."""
+    """Set up a Barry sensor for every selected metering point."""
     _LOGGER.debug("Setting up sensor")
-    config = config_entry.data
-    _dry_setup(hass, config, async_add_devices)
+    coordinator = hass.data[DOMAIN][config_entry.entry_id].coordinator
+    config = {**config_entry.data, **config_entry.options}
+    metering_points = config[CONF_METERING_POINTS]
+    sensors = [
+        BarrySensor(coordinator, metering_point[PRICE_CODE], metering_point[MPID])
+        for metering_point in metering_points
+    ]
+    if config.get(CONF_FORECAST, False):
+        sensors.extend(
+            BarryHorizonSensor(
+                coordinator, metering_point[PRICE_CODE], metering_point[MPID])
+            for metering_point in metering_points
+        )
+    # One CO2 sensor per price area
+    co2_areas = {
+        AsyncBarry.co2_area(metering_point[PRICE_CODE]): metering_point[PRICE_CODE]
+        for metering_point in metering_points
+    }
+    sensors.extend(
+        BarryCo2Sensor(coordinator, price_code, config_entry.entry_id)
+        for price_code in co2_areas.values()
+    )
+    sensors.extend(
+        BarryDiagnosticSensor(coordinator.metrics, config_entry, key)
+        for key in DIAGNOSTICS
+    )
+    async_add_devices(sensors)
+
+    platform = entity_platform.async_get_current_platform()
+    platform.async_register_entity_service(
+        SERVICE_FIND_CHEAPEST_WINDOW,
+        {
+            vol.Optional(ATTR_DURATION, default=DEFAULT_WINDOW_DURATION): cv.positive_time_period,
+            vol.Optional(ATTR_CONTIGUOUS, default=True): cv.boolean,
+            vol.Optional(ATTR_EARLIEST_START): cv.datetime,
+            vol.Optional(ATTR_DEADLINE): cv.datetime,
+        },
+        "async_find_cheapest_window",
+        required_features=[SUPPORT_FIND_CHEAPEST_WINDOW],
+        supports_response=SupportsResponse.ONLY,
+    )
     return True
 
 
+def _as_local(value):
+    """Treat naive datetimes from service calls as local time."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=dt_utils.DEFAULT_TIME_ZONE)
+    return dt_utils.as_local(value)
+
+
+def _upcoming(entries) -> list:
+    now = dt_utils.now()
+    return [entry for entry in entries if entry["end"] > now]
+
+
+def _summarize_window(window):
+    if window is None:
+        return None
+    return {
+        "start": window["start"],
+        "end": window["end"],
+        "average": window["average"],
+    }
+
+
+def _find_window(entries, duration, contiguous, earliest_start, deadline) -> dict:
+    """Service response with the cheapest window in the upcoming entries."""
+    if earliest_start is not None:
+        earliest_start = _as_local(earliest_start)
+    if deadline is not None:
+        deadline = _as_local(deadline)
+    window = cheapest_window(
+        _upcoming(entries), duration, contiguous, earliest_start, deadline)
+    return {"window": _serialize_window(window)}
+
+
+def _serialize_window(window):
+    if window is None:
+        return None
+    return {
+        "start": window["start"].isoformat(),
+        "end": window["end"].isoformat(),
+        "average": window["average"],
+        "slots": [
+            {
+                "start": slot["start"].isoformat(),
+                "end": slot["end"].isoformat(),
+                "value": slot["value"],
+            }
+            for slot in window["slots"]
+        ],
+    }
+
+
 class BarrySensor(Entity):
     """Representation of a Sensor."""
 
+    # Updates are pushed by the coordinator
+    _attr_should_poll = False
+    _attr_supported_features = SUPPORT_FIND_CHEAPEST_WINDOW
+
+    # The price series are only useful live, keep them out of the database
+    _unrecorded_attributes = frozenset(
+        {"raw_today", "raw_tomorrow", "today", "tomorrow"}
+    )
+
     def __init__(
         self,
-        barry_home,
+        coordinator,
         price_code,
         meter_id
     ) -> None:
         """Initialize the sensor."""
-        self._barry_home = barry_home
+        self._coordinator = coordinator
         self._price_code = price_code
         self._meter_id = meter_id
         self._attr_name = "Electricity price Barry"
@@ -67,6 +226,8 @@ class BarrySensor(Entity):
         self._current_spot_price = None
         self._currency = "DKK"
         self._price_type = "kWh"
+        self._today_source = None
+        self._tomorrow_source = None
         self._raw_today = None
         self._raw_tomorrow = None
         self._today = None
@@ -77,6 +238,8 @@ class BarrySensor(Entity):
         self._off_peak_1 = None
         self._off_peak_2 = None
         self._peak = None
+        self._cheapest_window = None
+        self._fingerprint = None
 
     @property
     def device_info(self):
@@ -129,6 +292,7 @@ class BarrySensor(Entity):
             "peak": self._peak,
             "min": self._min,
             "max": self._max,
+            "cheapest_window": self._cheapest_window,
         }
 
     @property
@@ -161,63 +325,360 @@ class BarrySensor(Entity):
 
     def _update_current_price(self) -> None:
         _LOGGER.debug("Updating current price")
-        _LOGGER.debug("barry_home: %s", self._barry_home)
-        total_price = self._barry_home.get_current_total_price(self._meter_id)
-        spot_price = self._barry_home.get_current_spot_price(self._price_code)
-        _LOGGER.debug("Got prices: %s | %s", total_price, spot_price)
-        self._current_total_price = total_price["value"]
-        self._current_spot_price = spot_price["value"]
+        self._current_total_price = self._coordinator.current_total_price(
+            self._meter_id)
+        self._current_spot_price = self._coordinator.current_spot_price(
+            self._price_code)
         _LOGGER.debug("Updated %s with new prices: %s/%s", self.name,
                       self._current_total_price, self._current_spot_price)
 
     def _update_prices(self) -> None:
         _LOGGER.debug("Updating all prices")
-        data_today = self._barry_home.get_total_prices_today(self._meter_id)
-        data_tomorrow = self._barry_home.get_total_prices_tomorrow(
-            self._meter_id)
+        data_today = self._coordinator.prices(self._meter_id, TODAY)
+        data_tomorrow = self._coordinator.prices(self._meter_id, TOMORROW)
+        if not data_today:
+            return
+        if data_tomorrow is not self._tomorrow_source:
+            self._tomorrow_source = data_tomorrow
+            self._raw_tomorrow, self._tomorrow = self._map_prices(data_tomorrow)
+            _LOGGER.debug("Fixed data tomorrow: %s", self._raw_tomorrow)
+        if data_today is self._today_source:
+            return
+        self._today_source = data_today
         self._raw_today, self._today = self._map_prices(data_today)
-        self._raw_tomorrow, self._tomorrow = self._map_prices(data_tomorrow)
-
         _LOGGER.debug("Fixed data today: %s", self._raw_today)
-        _LOGGER.debug("Fixed data tomorrow: %s", self._raw_tomorrow)
-        _LOGGER.debug("Raw prices today: %s", self._today)
-        _LOGGER.debug("Raw prices tomorrow: %s", self._tomorrow)
-
-        offpeak1 = self._today[0:8]
-        peak = self._today[9:17]
-        offpeak2 = self._today[20:]
-
-        self._peak = mean(peak)
-        self._off_peak_1 = mean(offpeak1)
-        self._off_peak_2 = mean(offpeak2)
-        self._average = mean(self._today)
-        self._min = min(self._today)
-        self._max = max(self._today)
-
-    def _map_prices(self, data) -> dict:
-        newdata = []
-        rawprices = []
-        # Sorting to ensure we have the correct order
-        data.sort(key=itemgetter('start'))
-        for entry in data:
-            newdata.append({
-                "start": dt_utils.as_local(dateutil.parser.isoparse(entry["start"])),
-                "end": dt_utils.as_local(dateutil.parser.isoparse(entry["end"])),
-                "value": entry["value"]
-            })
-            rawprices.append(entry["value"])
-
-        return newdata, rawprices
-
-    async def check_stuff(self) -> None:
-        _LOGGER.debug("Called check_stuff")
-        await self.hass.async_add_executor_job(self._update_current_price)
-        await self.hass.async_add_executor_job(self._update_prices)
+
+        index = data_today.index
+        self._update_windows(data_today)
+        self._average = index.mean()
+        self._min = index.min
+        self._max = index.max
+
+    def _update_windows(self, series) -> None:
+        tz = dt_utils.DEFAULT_TIME_ZONE
+        day = dt_utils.now().date()
+        means = {
+            name: series.window_mean(
+                local_time(day, start, tz), local_time(day, end, tz))
+            for name, (start, end) in PRICE_WINDOWS.items()
+        }
+        self._off_peak_1 = means.get("off_peak_1")
+        self._peak = means.get("peak")
+        self._off_peak_2 = means.get("off_peak_2")
+
+    def _map_prices(self, series) -> dict:
+        if not series:
+            return [], []
+        return series.entries(dt_utils.DEFAULT_TIME_ZONE), series.value_list()
+
+    def _known_prices(self) -> list:
+        return (self._raw_today or []) + (self._raw_tomorrow or [])
+
+    def _update_cheapest_window(self) -> None:
+        self._cheapest_window = _summarize_window(
+            cheapest_window(_upcoming(self._known_prices()), DEFAULT_WINDOW_DURATION))
+
+    async def async_find_cheapest_window(
+        self,
+        duration,
+        contiguous,
+        earliest_start=None,
+        deadline=None,
+    ) -> dict:
+        """Find the cheapest window in the known prices from now on."""
+        return _find_window(
+            self._known_prices(), duration, contiguous, earliest_start, deadline)
+
+    def _update(self) -> None:
+        self._update_current_price()
+        self._update_prices()
+        self._update_cheapest_window()
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        _LOGGER.debug("Called _handle_coordinator_update")
+        self._update()
+        # The series only change by being replaced, comparing them by
+        # identity covers all attributes derived from them
+        fingerprint = (
+            self._current_total_price,
+            self._current_spot_price,
+            self._today_source,
+            self._tomorrow_source,
+            self._cheapest_window,
+        )
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.async_write_ha_state()
 
     async def async_added_to_hass(self):
-        """Connect to dispatcher listening for entity data notifications."""
+        """Subscribe to data updates from the coordinator."""
         await super().async_added_to_hass()
         _LOGGER.debug("called async_added_to_hass %s", self.name)
-        async_dispatcher_connect(self.hass, EVENT_NEW_DATA, self.check_stuff)
+        self.async_on_remove(
+            self._coordinator.async_subscribe(
+                self._meter_id, self._price_code,
+                self._handle_coordinator_update)
+        )
+
+        if self._coordinator.has_data(self._meter_id):
+            self._handle_coordinator_update()
+        # Only days missing from the stored cache are fetched
+        self.hass.async_create_task(self._coordinator.async_refresh())
+
+
+class BarryCo2Sensor(Entity):
+    """CO2 intensity of the electricity in a price area."""
+
+    _attr_should_poll = False
+    _attr_supported_features = SUPPORT_FIND_CHEAPEST_WINDOW
+
+    _unrecorded_attributes = frozenset({"raw_today", "today"})
+
+    def __init__(self, coordinator, price_code, entry_id) -> None:
+        """Initialize the sensor."""
+        self._coordinator = coordinator
+        self._price_code = price_code
+        self._area = AsyncBarry.co2_area(price_code)
+        self._attr_unique_id = co2_unique_id(entry_id, self._area)
+        self._current_intensity = None
+        self._today_source = None
+        self._raw_today = None
+        self._today = None
+        self._average = None
+        self._min = None
+        self._max = None
+        self._cleanest_window = None
+        self._fingerprint = None
+
+    @property
+    def device_info(self):
+        return {
+            "identifiers": {(DOMAIN, self.unique_id)},
+            "name": self.name,
+            "manufacturer": DOMAIN,
+        }
+
+    @property
+    def name(self) -> str:
+        return ("barry_co2_%s" % self._area).lower().replace(" ", "_")
+
+    @property
+    def state(self) -> float:
+        return self._current_intensity
+
+    @property
+    def unit_of_measurement(self) -> str:
+        return "gCO2/kWh"
+
+    @property
+    def icon(self) -> str:
+        return "mdi:molecule-co2"
 
-        await self.check_stuff()
+    @property
+    def extra_state_attributes(self) -> dict:
+        return {
+            "raw_today": self._raw_today,
+            "today": self._today,
+            "average": self._average,
+            "min": self._min,
+            "max": self._max,
+            "cleanest_window": self._cleanest_window,
+        }
+
+    def _update_intensity(self) -> None:
+        self._current_intensity = self._coordinator.current_co2_intensity(
+            self._price_code)
+        series = self._coordinator.co2(self._price_code)
+        if series is self._today_source:
+            return
+        self._today_source = series
+        if not series:
+            self._raw_today, self._today = [], []
+            self._average = self._min = self._max = None
+            return
+        self._raw_today = series.entries(dt_utils.DEFAULT_TIME_ZONE)
+        self._today = series.value_list()
+        self._average = series.index.mean()
+        self._min = series.index.min
+        self._max = series.index.max
+
+    async def async_find_cheapest_window(
+        self,
+        duration,
+        contiguous,
+        earliest_start=None,
+        deadline=None,
+    ) -> dict:
+        """Find the cleanest window in the known intensities from now on."""
+        return _find_window(
+            self._raw_today or [], duration, contiguous, earliest_start, deadline)
+
+    def _update(self) -> None:
+        self._update_intensity()
+        self._cleanest_window = _summarize_window(
+            cheapest_window(_upcoming(self._raw_today or []), DEFAULT_WINDOW_DURATION))
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        self._update()
+        fingerprint = (
+            self._current_intensity, self._today_source, self._cleanest_window)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.async_write_ha_state()
+
+    async def async_added_to_hass(self):
+        """Subscribe to data updates from the coordinator."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            self._coordinator.async_subscribe(
+                None, self._price_code, self._handle_coordinator_update)
+        )
+        if self._coordinator.co2(self._price_code) is not None:
+            self._handle_coordinator_update()
+        self.hass.async_create_task(self._coordinator.async_refresh())
+
+
+class BarryHorizonSensor(Entity):
+    """Known prices of a metering point extended with a forecast, up to
+    HORIZON ahead.
+    """
+
+    _attr_should_poll = False
+    _attr_supported_features = SUPPORT_FIND_CHEAPEST_WINDOW
+
+    _unrecorded_attributes = frozenset({"horizon"})
+
+    def __init__(self, coordinator, price_code, meter_id) -> None:
+        """Initialize the sensor."""
+        self._coordinator = coordinator
+        self._price_code = price_code
+        self._meter_id = meter_id
+        self._horizon = []
+        self._known_until = None
+        self._forecast_mean = None
+        self._cheapest_window = None
+        self._fingerprint = None
+
+    @property
+    def name(self) -> str:
+        return self.unique_id
+
+    @property
+    def unique_id(self):
+        name = "barry_horizon_%s_%s" % (self._price_code, self._meter_id)
+        return name.lower().replace(".", "").replace(" ", "_")
+
+    @property
+    def state(self) -> float:
+        return self._forecast_mean
+
+    @property
+    def unit_of_measurement(self) -> str:
+        return "DKK/kWh"
+
+    @property
+    def icon(self) -> str:
+        return "mdi:crystal-ball"
+
+    @property
+    def extra_state_attributes(self) -> dict:
+        return {
+            "known_until": self._known_until,
+            "forecast_average": self._forecast_mean,
+            "horizon": self._horizon,
+            "cheapest_window": self._cheapest_window,
+        }
+
+    def _known_prices(self) -> list:
+        tz = dt_utils.DEFAULT_TIME_ZONE
+        entries = []
+        for offset in (TODAY, TOMORROW):
+            series = self._coordinator.prices(self._meter_id, offset)
+            if series:
+                entries.extend(series.entries(tz))
+        return _upcoming(entries)
+
+    def _update_horizon(self) -> None:
+        now = dt_utils.now()
+        known = [dict(entry, forecast=False) for entry in self._known_prices()]
+        start = known[-1]["end"] if known else now.replace(
+            minute=0, second=0, microsecond=0)
+        forecast = [
+            dict(entry, forecast=True)
+            for entry in self._coordinator.forecast(
+                self._meter_id, start, now + HORIZON)
+        ]
+        self._horizon = known + forecast
+        self._known_until = known[-1]["end"] if known else None
+        self._forecast_mean = (
+            sum(entry["value"] for entry in forecast) / len(forecast)
+            if forecast else None
+        )
+
+    async def async_find_cheapest_window(
+        self,
+        duration,
+        contiguous,
+        earliest_start=None,
+        deadline=None,
+    ) -> dict:
+        """Find the cheapest window in the known and forecast prices."""
+        return _find_window(
+            self._horizon, duration, contiguous, earliest_start, deadline)
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        self._update_horizon()
+        self._cheapest_window = _summarize_window(
+            cheapest_window(self._horizon, DEFAULT_WINDOW_DURATION))
+        fingerprint = (
+            self._known_until, self._forecast_mean, self._cheapest_window)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self.async_write_ha_state()
+
+    async def async_added_to_hass(self):
+        """Subscribe to data updates from the coordinator."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            self._coordinator.async_subscribe(
+                self._meter_id, self._price_code,
+                self._handle_coordinator_update)
+        )
+        self._handle_coordinator_update()
+
+
+class BarryDiagnosticSensor(Entity):
+    """A metric of the API client and coordinator of an entry."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    # Named after the entry's device, so entries don't share entity ids
+    _attr_has_entity_name = True
+
+    # The per-series and per-method breakdowns are for live inspection
+    _unrecorded_attributes = frozenset({"methods", "series"})
+
+    def __init__(self, metrics, config_entry, key) -> None:
+        """Initialize the sensor."""
+        self._metrics = metrics
+        name, unit, device_class, self._state, self._attributes = DIAGNOSTICS[key]
+        self._attr_name = name
+        self._attr_unique_id = "barry_%s_%s" % (config_entry.entry_id, key)
+        self._attr_device_info = {
+            "identifiers": {(DOMAIN, config_entry.entry_id)},
+            "name": config_entry.title,
+            "manufacturer": DOMAIN,
+            "entry_type": DeviceEntryType.SERVICE,
+        }
+        self._attr_unit_of_measurement = unit
+        self._attr_device_class = device_class
+
+    @property
+    def state(self):
+        return self._state(self._metrics)
+
+    @property
+    def extra_state_attributes(self) -> dict:
+        return self._attributes(self._metrics)
@@ -0,0 +1,170 @@
+"""Compact price series for the Barry integration."""
+from array import array
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+import math
+
+from .stats import PriceIndex
+
+BARRY_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def parse_epoch(stamp: str) -> float:
+    """Epoch of a Barry UTC timestamp."""
+    return datetime.fromisoformat(stamp.replace("Z", "+00:00")).timestamp()
+
+
+def local_time(day: date, at: time, tz: tzinfo) -> datetime:
+    """Aware datetime of a wall clock time on a day, None meaning the
+    midnight ending the day.
+    """
+    if at is None:
+        return datetime.combine(day + timedelta(days=1), time(), tzinfo=tz)
+    return datetime.combine(day, at, tzinfo=tz)
+
+
+class PriceSeries:
+    """Evenly spaced prices backed by a start epoch and an array of values.
+
+    Entries as dicts with datetimes are only built when a consumer asks
+    for them, and the PriceIndex only when statistics are read. Missing
+    slots are NaN, they have no entry and no value.
+    """
+
+    __slots__ = ("start", "resolution", "values", "_index", "_entries")
+
+    def __init__(self, start: float, resolution: int, values=()) -> None:
+        self.start = start
+        self.resolution = resolution
+        self.values = array("d", values)
+        self._index = None
+        self._entries = None
+
+    @classmethod
+    def from_entries(cls, entries) -> "PriceSeries":
+        """Build a series from the start/end/value dicts Barry returns.
+
+        Slots are placed by their start like append does, with the length
+        of the first one, so a missing slot leaves a NaN in its place and
+        a repeated one is ignored.
+        """
+        series = cls(0.0, 3600)
+        for entry in sorted(entries, key=lambda e: e["start"]):
+            series.append(parse_epoch(entry["start"]), parse_epoch(entry["end"]),
+                          entry["value"])
+        return series
+
+    def append(self, start: float, end: float, value: float) -> None:
+        """Add a slot by its epochs, for building a series as entries are
+        decoded.
+
+        The first slot sets the start and resolution, missing slots before
+        a later one are filled with NaN and slots not after the last one
+        are ignored.
+        """
+        if not self.values:
+            self.start = start
+            self.resolution = int(end - start)
+            position = 0
+        else:
+            position = int((start - self.start) // self.resolution)
+            if position < len(self.values):
+                return
+            if position > len(self.values):
+                self.values.extend([math.nan] * (position - len(self.values)))
+        self.values.append(value)
+        self._index = None
+        self._entries = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PriceSeries":
+        return cls(data["start"], data["resolution"], data["values"])
+
+    def as_dict(self) -> dict:
+        """Return the series in a JSON serializable form."""
+        return {
+            "start": self.start,
+            "resolution": self.resolution,
+            "values": self.values.tolist(),
+        }
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __bool__(self) -> bool:
+        return len(self.values) > 0
+
+    @property
+    def end(self) -> float:
+        return self.start + len(self.values) * self.resolution
+
+    @property
+    def index(self) -> PriceIndex:
+        if self._index is None:
+            self._index = PriceIndex(self.values)
+        return self._index
+
+    def slot_at(self, when: datetime):
+        """Return the position of the slot covering a time, or None."""
+        position = int((when.timestamp() - self.start) // self.resolution)
+        if 0 <= position < len(self.values):
+            return position
+        return None
+
+    def positions(self, start: datetime, end: datetime):
+        """Return the [first, last) positions of the slots starting within
+        the given times, clamped to the series.
+        """
+        first = math.ceil((start.timestamp() - self.start) / self.resolution)
+        last = math.ceil((end.timestamp() - self.start) / self.resolution)
+        size = len(self.values)
+        return min(max(first, 0), size), min(max(last, 0), size)
+
+    def window_mean(self, start: datetime, end: datetime):
+        """Mean of the slots starting within the given times."""
+        return self.index.mean(*self.positions(start, end))
+
+    def value_at(self, when: datetime):
+        position = self.slot_at(when)
+        return None if position is None else self._value(position)
+
+    def _value(self, position: int):
+        value = self.values[position]
+        return None if math.isnan(value) else value
+
+    def value_list(self) -> list:
+        """The values with None for missing slots."""
+        return [None if math.isnan(value) else value for value in self.values]
+
+    def latest_at(self, when: datetime):
+        """Value of the last slot starting at or before a time, None
+        before the series starts.
+        """
+        position = int((when.timestamp() - self.start) // self.resolution)
+        if position < 0 or not self.values:
+            return None
+        return self._value(min(position, len(self.values) - 1))
+
+    def slot_start(self, position: int, tz: tzinfo = timezone.utc) -> datetime:
+        return datetime.fromtimestamp(
+            self.start + position * self.resolution, tz)
+
+    def entries(self, tz: tzinfo) -> list:
+        """Materialize the series as start/end/value dicts in a timezone,
+        leaving out missing slots.
+
+        The list is built once per timezone and shared, consumers must not
+        modify it.
+        """
+        if self._entries is None or self._entries[0] is not tz:
+            # Boundaries from epochs, aware datetime arithmetic would be
+            # wall clock arithmetic and break on DST changes
+            bounds = [self.slot_start(position, tz)
+                      for position in range(len(self.values) + 1)]
+            entries = [
+                {"start": bounds[position], "end": bounds[position + 1],
+                 "value": value}
+                for position, value in enumerate(self.values)
+                if not math.isnan(value)
+            ]
+            self._entries = (tz, entries)
+        return self._entries[1]
@@ -0,0 +1,47 @@
+"""Precomputed price statistics for the Barry integration."""
+from itertools import accumulate
+import math
+
+
+class PriceIndex:
+    """Statistics over one series of prices, built once when it arrives.
+
+    Holds the sort order and prefix sums, so means over any slot range
+    and min/max are read in constant time. Missing slots, NaN, are left
+    out of all of them.
+    """
+
+    __slots__ = ("values", "order", "_prefix", "_counts")
+
+    def __init__(self, values) -> None:
+        self.values = list(values)
+        known = [not math.isnan(value) for value in self.values]
+        self._prefix = list(accumulate(
+            (value if is_known else 0.0
+             for value, is_known in zip(self.values, known)),
+            initial=0.0))
+        self._counts = list(accumulate(known, initial=0))
+        self.order = sorted(
+            (slot for slot, is_known in enumerate(known) if is_known),
+            key=self.values.__getitem__)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def mean(self, start: int = 0, end: int = None):
+        """Mean of the slots in [start:end], None if none of them is known."""
+        start, end, _ = slice(start, end).indices(len(self.values))
+        if end <= start:
+            return None
+        count = self._counts[end] - self._counts[start]
+        if not count:
+            return None
+        return (self._prefix[end] - self._prefix[start]) / count
+
+    @property
+    def min(self):
+        return self.values[self.order[0]] if self.order else None
+
+    @property
+    def max(self):
+        return self.values[self.order[-1]] if self.order else None
@@ -0,0 +1,82 @@
+"""Tests of the retries and circuit breaker of the Barry client."""
+import asyncio
+
+import aiohttp
+from aiohttp import web
+import pytest
+
+pytest.importorskip("homeassistant")
+
+# The client is tested against servers on 127.0.0.1
+pytestmark = pytest.mark.usefixtures("socket_enabled")
+
+from custom_components.barry import pybarry  # noqa: E402
+from custom_components.barry.pybarry import (  # noqa: E402
+    AsyncBarry,
+    BarryConnectionError,
+    BarryError,
+)
+
+
+async def _call_endpoint(responses, calls=1, retries=1):
+    """Call an endpoint answering with the given responses in turn,
+    returns the results or errors of the calls, the requests made and the
+    failures the breaker counted.
+    """
+    requests = []
+
+    async def handle(request):
+        requests.append(await request.json())
+        status, body = responses[min(len(requests), len(responses)) - 1]
+        return web.Response(status=status, text=body)
+
+    app = web.Application()
+    app.router.add_post("/json-rpc", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        async with aiohttp.ClientSession() as session:
+            api = AsyncBarry(session, batch=False, retries=retries)
+            api.endpoint = f"http://127.0.0.1:{port}/json-rpc"
+            results = []
+            for _ in range(calls):
+                try:
+                    results.append(await api._call("getPrice", []))
+                except BarryError as err:
+                    results.append(err)
+            return results, len(requests), api.breaker.failures
+    finally:
+        await runner.cleanup()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(pybarry, "_backoff", lambda attempt: 0)
+
+
+@pytest.mark.parametrize("status", [200, 403, 502])
+def test_html_body_is_retried(status):
+    results, requests, failures = asyncio.run(_call_endpoint(
+        [(status, "<html>Down for maintenance</html>")]))
+    assert isinstance(results[0], BarryConnectionError)
+    assert requests == 2
+    assert failures == 1
+
+
+def test_rate_limit_is_retried():
+    results, requests, failures = asyncio.run(_call_endpoint(
+        [(429, "Too Many Requests"), (200, '{"id": 0, "result": [1]}')]))
+    assert results == [[1]]
+    assert requests == 2
+    assert failures == 0
+
+
+def test_breaker_opens_on_invalid_bodies():
+    results, requests, failures = asyncio.run(_call_endpoint(
+        [(200, "not json")], calls=pybarry.BREAKER_THRESHOLD + 1, retries=0))
+    assert requests == pybarry.BREAKER_THRESHOLD
+    assert isinstance(results[-1], pybarry.CircuitOpenError)
+    assert failures == pybarry.BREAKER_THRESHOLD
@@ -0,0 +1,98 @@
+"""Tests of the day ranges and price windows on DST days."""
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+pytest.importorskip("homeassistant")
+
+from custom_components.barry import pybarry  # noqa: E402
+from custom_components.barry.const import PRICE_WINDOWS  # noqa: E402
+from custom_components.barry.series import PriceSeries, local_time  # noqa: E402
+from custom_components.barry.stats import PriceIndex  # noqa: E402
+
+COPENHAGEN = ZoneInfo("Europe/Copenhagen")
+SPRING = date(2024, 3, 31)
+AUTUMN = date(2024, 10, 27)
+
+
+def _freeze(monkeypatch, day):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(day.year, day.month, day.day, 12, tzinfo=tz)
+
+    monkeypatch.setattr(pybarry, "datetime", FrozenDatetime)
+
+
+@pytest.mark.parametrize(
+    "day, start, end",
+    [
+        (date(2024, 6, 1), "2024-05-31T22:00:00Z", "2024-06-01T22:00:00Z"),
+        (SPRING, "2024-03-30T23:00:00Z", "2024-03-31T22:00:00Z"),
+        (AUTUMN, "2024-10-26T22:00:00Z", "2024-10-27T23:00:00Z"),
+    ],
+)
+def test_day_window(monkeypatch, day, start, end):
+    _freeze(monkeypatch, day)
+    assert pybarry._day_window(0, COPENHAGEN) == (start, end)
+
+
+def test_day_window_offset(monkeypatch):
+    _freeze(monkeypatch, date(2024, 3, 30))
+    assert pybarry._day_window(1, COPENHAGEN) == (
+        "2024-03-30T23:00:00Z", "2024-03-31T22:00:00Z")
+
+
+def _day_series(day, minutes):
+    """A series over a local day with the slot position as its price."""
+    start = local_time(day, None, COPENHAGEN) - timedelta(days=1)
+    end = local_time(day, None, COPENHAGEN)
+    slots = int(end.timestamp() - start.timestamp()) // (minutes * 60)
+    return PriceSeries(start.timestamp(), minutes * 60, range(slots))
+
+
+@pytest.mark.parametrize("minutes", [60, 15])
+@pytest.mark.parametrize(
+    "day, hours",
+    [(date(2024, 6, 1), 24), (SPRING, 23), (AUTUMN, 25)],
+)
+def test_day_series_length(day, hours, minutes):
+    assert len(_day_series(day, minutes)) == hours * 60 // minutes
+
+
+@pytest.mark.parametrize("minutes", [60, 15])
+@pytest.mark.parametrize("day", [date(2024, 6, 1), SPRING, AUTUMN])
+@pytest.mark.parametrize("window", sorted(PRICE_WINDOWS))
+def test_window_mean(day, minutes, window):
+    series = _day_series(day, minutes)
+    start, end = (
+        local_time(day, at, COPENHAGEN) for at in PRICE_WINDOWS[window])
+    expected = [
+        value for position, value in enumerate(series.values)
+        if start <= series.slot_start(position, COPENHAGEN) < end
+    ]
+
+    first, last = series.positions(start, end)
+    assert last - first == len(expected)
+    assert series.window_mean(start, end) == pytest.approx(
+        sum(expected) / len(expected))
+    assert PriceIndex(series.values).mean(first, last) == pytest.approx(
+        sum(expected) / len(expected))
+
+
+@pytest.mark.parametrize("minutes", [60, 15])
+def test_window_hours_on_dst_days(minutes):
+    slots_per_hour = 60 // minutes
+    spring = _day_series(SPRING, minutes)
+    autumn = _day_series(AUTUMN, minutes)
+    start, end = (local_time(SPRING, at, COPENHAGEN)
+                  for at in PRICE_WINDOWS["off_peak_1"])
+    first, last = spring.positions(start, end)
+    # 02:00 to 03:00 does not exist on the day DST starts
+    assert last - first == 7 * slots_per_hour
+    start, end = (local_time(AUTUMN, at, COPENHAGEN)
+                  for at in PRICE_WINDOWS["off_peak_1"])
+    first, last = autumn.positions(start, end)
+    # and 02:00 to 03:00 happens twice on the day it ends
+    assert last - first == 9 * slots_per_hour
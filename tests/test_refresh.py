@@ -0,0 +1,125 @@
+"""Tests of the client and coordinator against the fake Barry server."""
+import asyncio
+from datetime import date, datetime, time
+import json
+import os
+from zoneinfo import ZoneInfo
+
+import aiohttp
+import pytest
+
+pytest.importorskip("homeassistant")
+
+# The client is tested against servers on 127.0.0.1
+pytestmark = pytest.mark.usefixtures("socket_enabled")
+
+from bench.fake_barry import RESPONSES, FakeBarryServer  # noqa: E402
+from custom_components.barry import pybarry  # noqa: E402
+from custom_components.barry.const import PRICE_WINDOWS  # noqa: E402
+from custom_components.barry.coordinator import TODAY, BarryCoordinator  # noqa: E402
+from custom_components.barry.pybarry import AsyncBarry  # noqa: E402
+from custom_components.barry.series import PriceSeries, local_time  # noqa: E402
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+COPENHAGEN = ZoneInfo("Europe/Copenhagen")
+DST_END = date(2024, 10, 27)
+METERS = [
+    ("571313100000000001", "DK_NORDPOOL_SPOT_DK1"),
+    ("571313100000000003", "DK_NORDPOOL_SPOT_DK2"),
+]
+
+
+def _recorded_result(name):
+    with open(os.path.join(RESPONSES, name), encoding="utf-8") as exchange:
+        return json.load(exchange)["response"]["result"]
+
+
+async def _with_server(test, **kwargs):
+    server = FakeBarryServer(**kwargs)
+    await server.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            return await test(server, session)
+    finally:
+        await server.stop()
+
+
+def test_dst_day_responses(monkeypatch):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2024, 10, 27, 12, tzinfo=tz)
+
+    monkeypatch.setattr(pybarry, "datetime", FrozenDatetime)
+
+    async def fetch(server, session):
+        api = AsyncBarry(session, tz=COPENHAGEN)
+        api.endpoint = server.url
+        return await asyncio.gather(
+            api.get_total_prices_offset(METERS[0][0], TODAY),
+            api.get_co2_intensity_offset(METERS[0][1], TODAY),
+        )
+
+    prices, co2 = asyncio.run(_with_server(fetch))
+
+    assert prices == _recorded_result("getTotalKwHourlyPrice_2024-10-27.json")
+    assert [entry["value"] for entry in co2] == [
+        entry["carbonIntensity"]
+        for entry in _recorded_result("getHourlyCo2Intensity_2024-10-27.json")
+    ]
+    series = PriceSeries.from_entries(prices)
+    assert len(series) == 25
+    start, end = (
+        local_time(DST_END, at, COPENHAGEN) for at in PRICE_WINDOWS["off_peak_1"])
+    first, last = series.positions(start, end)
+    assert (first, last) == (0, 9)
+    assert series.window_mean(start, end) == pytest.approx(
+        sum(entry["value"] for entry in prices[:9]) / 9)
+
+
+@pytest.mark.parametrize("batch, requests", [(True, 1), (False, 7)])
+def test_refresh_request_counts(tmp_path, batch, requests):
+    async def refresh(server, session):
+        hass = HomeAssistant(str(tmp_path))
+        api = AsyncBarry(session, batch=batch, tz=COPENHAGEN)
+        api.endpoint = server.url
+        coordinator = BarryCoordinator(hass, api, time(13), "test")
+        notified = []
+        for mpid, price_code in METERS:
+            coordinator.async_subscribe(
+                mpid, price_code, lambda mpid=mpid: notified.append(mpid))
+
+        await coordinator.async_refresh(windows=[TODAY])
+        cold = (server.requests, server.calls)
+        server.reset_counters()
+        await coordinator.async_refresh(windows=[TODAY])
+        warm = (server.requests, server.calls)
+        return coordinator, cold, warm, notified
+
+    coordinator, cold, warm, notified = asyncio.run(_with_server(refresh))
+
+    # Total and spot prices per meter, CO2 per area and the metering points
+    assert cold == (requests, 7)
+    assert warm == (0, 0)
+    assert len(coordinator.metering_points) == 4
+    for mpid, price_code in METERS:
+        assert coordinator.current_total_price(mpid) is not None
+        assert coordinator.current_co2_intensity(price_code) is not None
+    assert set(notified) == {mpid for mpid, _ in METERS}
+
+
+@pytest.mark.parametrize("learn", [True, False])
+def test_refresh_learns_only_for_forecast(tmp_path, learn):
+    async def refresh(server, session):
+        hass = HomeAssistant(str(tmp_path))
+        api = AsyncBarry(session, tz=COPENHAGEN)
+        api.endpoint = server.url
+        coordinator = BarryCoordinator(hass, api, time(13), "test", learn=learn)
+        coordinator.async_subscribe(METERS[0][0], METERS[0][1], lambda: None)
+        await coordinator.async_refresh(windows=[TODAY])
+        return coordinator
+
+    coordinator = asyncio.run(_with_server(refresh))
+
+    assert coordinator.has_data(METERS[0][0])
+    assert (METERS[0][0] in coordinator.profiles) is learn
@@ -0,0 +1,78 @@
+"""Tests of price series built from Barry entries."""
+from datetime import datetime, timedelta, timezone
+import math
+
+import pytest
+
+pytest.importorskip("homeassistant")
+
+from custom_components.barry.cache import DayAheadCache  # noqa: E402
+from custom_components.barry.series import PriceSeries  # noqa: E402
+from custom_components.barry.stats import PriceIndex  # noqa: E402
+
+DAY = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+def _entries(hours, minutes=60):
+    slot = timedelta(minutes=minutes)
+    return [
+        {
+            "start": (DAY + hour * slot).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "end": (DAY + (hour + 1) * slot).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "value": float(hour),
+        }
+        for hour in hours
+    ]
+
+
+def test_contiguous():
+    series = PriceSeries.from_entries(_entries(range(24)))
+    assert len(series) == 24
+    assert series.resolution == 3600
+    assert series.value_at(DAY + timedelta(hours=3, minutes=30)) == 3.0
+
+
+def test_missing_slot_keeps_later_slots_in_place():
+    series = PriceSeries.from_entries(_entries([0, 1, 3, 4]))
+    assert len(series) == 5
+    assert series.value_at(DAY + timedelta(hours=2, minutes=30)) is None
+    assert series.value_at(DAY + timedelta(hours=3, minutes=30)) == 3.0
+    assert series.value_list() == [0.0, 1.0, None, 3.0, 4.0]
+    assert [entry["value"] for entry in series.entries(timezone.utc)] == [
+        0.0, 1.0, 3.0, 4.0]
+
+
+def test_repeated_and_unsorted_slots():
+    entries = _entries([2, 0, 1, 1, 3])
+    series = PriceSeries.from_entries(entries)
+    assert series.value_list() == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_quarter_hours():
+    series = PriceSeries.from_entries(_entries(range(8), minutes=15))
+    assert series.resolution == 900
+    assert series.value_at(DAY + timedelta(minutes=50)) == 3.0
+
+
+def test_index_ignores_missing_slots():
+    index = PriceIndex([4.0, math.nan, 1.0, 3.0])
+    assert index.mean() == pytest.approx(8 / 3)
+    assert index.mean(1, 2) is None
+    assert index.mean(1, 3) == 1.0
+    assert (index.min, index.max) == (1.0, 4.0)
+
+
+def test_latest_at():
+    series = PriceSeries.from_entries(_entries(range(3)))
+    assert series.latest_at(DAY - timedelta(minutes=1)) is None
+    assert series.latest_at(DAY + timedelta(hours=1)) == 1.0
+    assert series.latest_at(DAY + timedelta(hours=6)) == 2.0
+
+
+def test_cache_keeps_an_unchanged_gapped_series():
+    cache = DayAheadCache("test")
+    assert cache.set("key", DAY.date(), _entries([0, 2]))
+    series = cache.get("key", DAY.date())
+    assert not cache.set("key", DAY.date(), _entries([0, 2]))
+    assert cache.get("key", DAY.date()) is series
+    assert cache.set("key", DAY.date(), _entries([0, 1, 2]))
@@ -0,0 +1,114 @@
+"""Tests of the incremental decoding of streamed result arrays."""
+import asyncio
+from datetime import datetime, timezone
+
+import aiohttp
+import pytest
+
+pytest.importorskip("homeassistant")
+
+# The client is tested against servers on 127.0.0.1
+pytestmark = pytest.mark.usefixtures("socket_enabled")
+
+from bench.fake_barry import FakeBarryServer  # noqa: E402
+from custom_components.barry.pybarry import (  # noqa: E402
+    AsyncBarry,
+    BarryConnectionError,
+    BarryResponseError,
+    _ResultParser,
+)
+
+BODY = (
+    '{"jsonrpc": "2.0", "id": 0, "result": ['
+    '{"start": "2024-01-01T00:00:00Z", "value": 1.5}, '
+    '{"start": "2024-01-01T01:00:00Z", "value": 2.5}]}'
+)
+ITEMS = [
+    {"start": "2024-01-01T00:00:00Z", "value": 1.5},
+    {"start": "2024-01-01T01:00:00Z", "value": 2.5},
+]
+
+
+def _decode(*chunks):
+    parser = _ResultParser()
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    parser.close()
+    return items
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 16, len(BODY)])
+def test_chunked(size):
+    assert _decode(*(BODY[i:i + size] for i in range(0, len(BODY), size))) == ITEMS
+
+
+def test_key_split_across_chunks():
+    split = BODY.index('"result"') + 4
+    assert _decode(BODY[:split], BODY[split:]) == ITEMS
+
+
+def test_item_split_across_chunks():
+    parser = _ResultParser()
+    split = BODY.index("1.5") + 1
+    assert parser.feed(BODY[:split]) == []
+    assert parser.feed(BODY[split:]) == ITEMS
+    parser.close()
+
+
+def test_null_result():
+    assert _decode('{"jsonrpc": "2.0", "id": 0, "result": null}') == []
+
+
+@pytest.mark.parametrize("size", [5, 1000])
+def test_error_body(size):
+    body = ('{"jsonrpc": "2.0", "id": 0, '
+            '"error": {"code": -32601, "message": "Method not found"}}')
+    with pytest.raises(BarryResponseError, match="Method not found"):
+        _decode(*(body[i:i + size] for i in range(0, len(body), size)))
+
+
+def test_truncated_body():
+    with pytest.raises(BarryConnectionError):
+        _decode(BODY[:BODY.index("2.5")])
+
+
+def test_not_json():
+    with pytest.raises(BarryConnectionError):
+        _decode("<html><body>Down for maintenance</body></html>")
+
+
+def test_stream_error_answer():
+    async def stream():
+        server = FakeBarryServer()
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                api = AsyncBarry(session)
+                api.endpoint = server.url
+                return [item async for item in api._stream("nope", [])]
+        finally:
+            await server.stop()
+
+    with pytest.raises(BarryResponseError):
+        asyncio.run(stream())
+
+
+def test_stream_range():
+    async def stream():
+        server = FakeBarryServer()
+        await server.start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                api = AsyncBarry(session)
+                api.endpoint = server.url
+                return [
+                    entry async for entry in api.stream_total_prices_range(
+                        "571313100000000001",
+                        datetime(2024, 1, 1, tzinfo=timezone.utc),
+                        datetime(2024, 1, 3, tzinfo=timezone.utc))
+                ]
+        finally:
+            await server.stop()
+
+    assert len(asyncio.run(stream())) == 48